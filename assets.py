@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+import pygame
+
+from collections import OrderedDict
+
+
+class SilentSound():
+    """Stand-in for pygame.mixer.Sound when the mixer is not initialised."""
+    def play(self, *args, **kwargs) -> None:
+        pass
+
+    def set_volume(self, value: float) -> None:
+        pass
+
+
+class AssetManager():
+    """Load each image, font and sound once and share it.
+
+    Sprites receive the cached pygame.Surface / pygame.mixer.Sound objects instead
+    of file paths. With 'max_items', the least recently used assets are evicted
+    from the cache (the sprites still using them keep their reference).
+    The cache is shared with preload_async(): an asset asked before the background
+    thread reached it is simply loaded by the caller.
+    """
+    def __init__(self, assets_dir: str, max_items: int = None) -> None:
+        self.assets_dir: str = assets_dir
+        self.graphics_dir: str = os.path.join(assets_dir, "graphics")
+        self.audio_dir: str = os.path.join(assets_dir, "audio")
+        self.font_dir: str = os.path.join(assets_dir, "font")
+        self.max_items = max_items
+        self.cache: OrderedDict = OrderedDict()
+        self.loads: int = 0
+        self.lock = threading.Lock()
+        self.loader = None
+        self.load_time: float = 0.
+
+    def _get(self, key: tuple, loader):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        # Loaded without the lock, the other thread keeps going meanwhile
+        asset = loader()
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            self.loads += 1
+            self.cache[key] = asset
+            if self.max_items is not None:
+                while len(self.cache) > self.max_items:
+                    self.cache.popitem(last=False)
+        return asset
+
+    def image(self, name: str) -> pygame.Surface:
+        """Return the image 'name' from the graphics directory."""
+        def load():
+            image = pygame.image.load(os.path.join(self.graphics_dir, name))
+            if pygame.display.get_surface() is not None:
+                return image.convert_alpha()
+            # Headless games never call set_mode: convert to the ARGB layout of the
+            # canvas, PNGs are loaded as RGBA which blits an order of magnitude slower
+            return image.convert(pygame.Surface((1, 1), pygame.SRCALPHA, 32))
+        return self._get(("image", name), load)
+
+    def sound(self, name: str, volume: float = 1.0):
+        """Return the sound 'name' from the audio directory, silent without mixer.
+
+        The volume is a property of the pygame Sound: each volume of a file is a
+        sound of its own in the cache."""
+        def load():
+            if not pygame.mixer.get_init():
+                return SilentSound()
+            sound = pygame.mixer.Sound(os.path.join(self.audio_dir, name))
+            sound.set_volume(volume)
+            return sound
+        return self._get(("sound", name, volume), load)
+
+    def font(self, name: str, size: int) -> pygame.font.Font:
+        """Return the font 'name' from the font directory at the given size."""
+        return self._get(("font", name, size), lambda: pygame.font.Font(os.path.join(self.font_dir, name), size))
+
+    def play_music(self, name: str, volume: float = 1.0, loops: int = -1) -> bool:
+        """Stream the music 'name' with pygame.mixer.music, the track is never loaded entirely.
+
+        Returns False, without music, when the mixer is not initialised or the file is missing."""
+        path = os.path.join(self.audio_dir, name)
+        if not pygame.mixer.get_init() or not os.path.exists(path):
+            return False
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.set_volume(volume)
+        pygame.mixer.music.play(loops)
+        return True
+
+    def preload(self, images: list = (), sounds: dict = None) -> None:
+        """Load assets ahead of time, sounds is a dict {name: volume}."""
+        start = time.perf_counter()
+        for name in images:
+            self.image(name)
+        for name, volume in (sounds or {}).items():
+            self.sound(name, volume)
+        self.load_time = time.perf_counter() - start
+
+    def preload_async(self, images: list = (), sounds: dict = None) -> threading.Thread:
+        """Preload the assets on a background thread, wait() blocks until it is done."""
+        self.loader = threading.Thread(target=self.preload, args=(images, sounds), name="asset-loader", daemon=True)
+        self.loader.start()
+        return self.loader
+
+    def loaded(self) -> bool:
+        return self.loader is None or not self.loader.is_alive()
+
+    def wait(self) -> None:
+        if self.loader is not None:
+            self.loader.join()
@@ -0,0 +1,111 @@
+import time
+import pygame
+
+from settings import MIXER_CHANNELS
+
+
+class SoundSpec():
+    """How a named sound may be played."""
+    __slots__ = ("filename", "volume", "max_voices", "priority", "min_interval", "channel")
+
+    def __init__(self, filename: str, volume: float, max_voices: int, priority: int, min_interval: float, channel) -> None:
+        self.filename: str = filename
+        self.volume: float = volume
+        self.max_voices: int = max_voices
+        self.priority: int = priority
+        self.min_interval: float = min_interval
+        # Reserved channel index, None to share the free channels
+        self.channel = channel
+
+
+class SoundDispatcher():
+    """Play the game sounds within a fixed budget of mixer voices.
+
+    Every sound is registered under a name with:
+        - max_voices: the oldest voice of the sound is restarted beyond it
+        - priority: when no channel is free, the oldest voice of a lower or equal
+          priority is stolen, otherwise the sound is dropped
+        - min_interval_ms: the same sound is not started twice within this window
+        - reserved: the sound gets its own channel, never used by the others
+    The mixer never mixes more than 'channels' voices, however many sounds are asked.
+    Without mixer (headless), play() returns immediately.
+    """
+    def __init__(self, assets, channels: int = MIXER_CHANNELS, clock=time.perf_counter) -> None:
+        self.assets = assets
+        self.enabled: bool = bool(pygame.mixer.get_init())
+        self.channels: int = channels
+        self.clock = clock
+        self.specs: dict = {}
+        self.reserved: int = 0
+        # Playing voices: [channel index, name, priority, start]
+        self.voices: list = []
+        self.last_played: dict = {}
+        self.stats: dict = {"played": 0, "stolen": 0, "rate_limited": 0, "dropped": 0}
+        self.mixer_channels: list = []
+        if self.enabled:
+            pygame.mixer.set_num_channels(channels)
+            self.mixer_channels = [pygame.mixer.Channel(i) for i in range(channels)]
+
+    def register(self, name: str, filename: str, volume: float = 1.0, max_voices: int = 2, priority: int = 0,
+                 min_interval_ms: float = 0., reserved: bool = False) -> None:
+        channel = None
+        if reserved:
+            channel = self.reserved
+            self.reserved += 1
+            assert self.reserved < self.channels, "No channel left for the other sounds"
+            if self.enabled:
+                pygame.mixer.set_reserved(self.reserved)
+        self.specs[name] = SoundSpec(filename, volume, max_voices, priority, min_interval_ms / 1000, channel)
+
+    def play(self, name: str) -> bool:
+        """Play the sound 'name' if the budget allows it, return True if it is played."""
+        if not self.enabled:
+            return False
+        spec = self.specs[name]
+        now = self.clock()
+        if now - self.last_played.get(name, -spec.min_interval) < spec.min_interval:
+            self.stats["rate_limited"] += 1
+            return False
+        # Forget the voices which ended
+        self.voices = [voice for voice in self.voices if self.mixer_channels[voice[0]].get_busy()]
+
+        if spec.channel is not None:
+            index = spec.channel
+            self.voices = [voice for voice in self.voices if voice[0] != index]
+        else:
+            index = self.find_channel(name, spec)
+            if index is None:
+                self.stats["dropped"] += 1
+                return False
+        self.mixer_channels[index].play(self.assets.sound(spec.filename, spec.volume))
+        self.voices.append([index, name, spec.priority, now])
+        self.last_played[name] = now
+        self.stats["played"] += 1
+        return True
+
+    def find_channel(self, name: str, spec: SoundSpec):
+        """Index of a free channel, or of a voice to steal, None if the sound must be dropped."""
+        same = [voice for voice in self.voices if voice[1] == name]
+        if len(same) >= spec.max_voices:
+            # The voices are in start order: restart the oldest one
+            return self.steal(same[0])
+        used = {voice[0] for voice in self.voices}
+        for index in range(self.reserved, self.channels):
+            if index not in used:
+                return index
+        candidates = [voice for voice in self.voices if voice[2] <= spec.priority and self.specs[voice[1]].channel is None]
+        if not candidates:
+            return None
+        # Lowest priority first, then the oldest
+        return self.steal(min(candidates, key=lambda voice: (voice[2], voice[3])))
+
+    def steal(self, voice: list) -> int:
+        self.voices.remove(voice)
+        self.mixer_channels[voice[0]].stop()
+        self.stats["stolen"] += 1
+        return voice[0]
+
+    def stop(self) -> None:
+        if self.enabled:
+            pygame.mixer.stop()
+        self.voices.clear()
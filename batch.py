@@ -0,0 +1,208 @@
+import argparse
+import ast
+import glob
+import multiprocessing
+import os
+import random
+import sys
+import time
+import numpy as np
+import pygame
+
+from settings import *
+from replay import KeyState, KEY_BITS
+
+
+LEFT, RIGHT, SPACE = KEY_BITS[pygame.K_LEFT], KEY_BITS[pygame.K_RIGHT], KEY_BITS[pygame.K_SPACE]
+# Directory of the game modules
+ROOT: str = os.path.dirname(os.path.abspath(__file__))
+
+
+def idle_policy(world, rng: random.Random) -> int:
+    return 0
+
+
+def random_policy(world, rng: random.Random) -> int:
+    return rng.choice((0, LEFT, RIGHT, SPACE, LEFT | SPACE, RIGHT | SPACE))
+
+
+def tracker_policy(world, rng: random.Random) -> int:
+    """Move under the lowest alien and keep firing."""
+    aliens = world.aliens_wave.group.sprites()
+    if not aliens:
+        return 0
+    target = max(aliens, key=lambda alien: alien.rect.bottom).rect.centerx
+    x = world.player.sprite.rect.centerx
+    bits = SPACE
+    if target < x - SPACECRAFT_SPEED:
+        bits |= LEFT
+    elif target > x + SPACECRAFT_SPEED:
+        bits |= RIGHT
+    return bits
+
+
+POLICIES: dict = {"idle": idle_policy, "random": random_policy, "tracker": tracker_policy}
+
+
+def game_modules() -> list:
+    """The loaded modules of the game, including the script run as __main__."""
+    modules = []
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.dirname(os.path.abspath(path)) == ROOT:
+            modules.append(module)
+    return modules
+
+
+def override_settings(overrides: dict) -> None:
+    """Change settings values in settings.py and in every loaded module which imported them.
+
+    The modules imported later read the new values from settings.py.
+    """
+    import settings
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    for module in game_modules():
+        for key, value in overrides.items():
+            if hasattr(module, key):
+                setattr(module, key, value)
+
+
+def import_time_settings() -> set:
+    """Names of the settings read once, when the modules are imported.
+
+    They are bound in default arguments or in module and class level code (the
+    __main__ blocks aside), so overriding them afterwards would be ignored.
+    """
+    bound: set = set()
+    for path in glob.glob(os.path.join(ROOT, "*.py")):
+        with open(path, "r") as file:
+            tree = ast.parse(file.read())
+        nodes = []
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+                nodes += node.args.defaults + [default for default in node.args.kw_defaults if default is not None]
+        statements = list(tree.body)
+        while statements:
+            statement = statements.pop()
+            if isinstance(statement, ast.ClassDef):
+                statements += statement.body
+            elif isinstance(statement, ast.If) and "__main__" in ast.dump(statement.test):
+                continue
+            elif not isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                nodes.append(statement)
+        for node in nodes:
+            bound |= {name.id for name in ast.walk(node) if isinstance(name, ast.Name) and isinstance(name.ctx, ast.Load)}
+    return bound
+
+
+def play_game(game, seed: int, policy, max_ticks: int) -> tuple:
+    """Play one headless game and return (score, frames, won)."""
+    from states import GameWorld, WinState
+
+    game.seed = seed
+    game.rng.seed(seed)
+    policy_rng = random.Random(seed)
+    del game.state_stack[1:]
+    world = GameWorld(game)
+    world.enter_state()
+    keys = KeyState()
+    game.input_keys = keys
+
+    frames: int = 0
+    while frames < max_ticks and game.state_stack[-1] is world:
+        keys.bits = policy(world, policy_rng)
+        game.events = []
+        game.update()
+        frames += 1
+    return game.score, frames, isinstance(game.state_stack[-1], WinState)
+
+
+# One headless game per worker process
+_worker: dict = {}
+
+
+def init_worker(overrides: dict, policy: str, max_ticks: int) -> None:
+    from game import Game
+    override_settings(overrides)
+    _worker["game"] = Game(headless=True)
+    _worker["policy"] = POLICIES[policy]
+    _worker["max_ticks"] = max_ticks
+
+
+def run_seed(seed: int) -> tuple:
+    score, frames, won = play_game(_worker["game"], seed, _worker["policy"], _worker["max_ticks"])
+    return seed, score, frames, won
+
+
+def run_batch(n_games: int, policy: str = "random", processes: int = None, seed: int = 0,
+              max_ticks: int = 60 * TICK_RATE, overrides: dict = None, chunksize: int = None) -> dict:
+    """Play n_games independent games across a process pool.
+
+    Game i uses the seed 'seed + i'. Returns the results as columns, sorted by seed.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    chunksize = chunksize or max(1, n_games // (processes * 4))
+    seeds = range(seed, seed + n_games)
+    pool = multiprocessing.Pool(processes, init_worker, (overrides or {}, policy, max_ticks))
+    try:
+        rows = sorted(pool.imap_unordered(run_seed, seeds, chunksize=chunksize))
+    finally:
+        # SDL catches SIGTERM in the workers, so Pool.terminate() would hang: let them exit
+        pool.close()
+        pool.join()
+    return {
+        "seed": np.array([row[0] for row in rows], dtype=np.int64),
+        "score": np.array([row[1] for row in rows], dtype=np.int32),
+        "frames": np.array([row[2] for row in rows], dtype=np.int32),
+        "won": np.array([row[3] for row in rows], dtype=bool),
+    }
+
+
+def parse_override(text: str) -> tuple:
+    """Parse NAME=VALUE, the value as a Python literal of the type of the setting.
+
+    Raises ValueError for an unknown setting, a value of another type or a
+    setting which would not be picked up (see import_time_settings).
+    """
+    import settings
+    key, _, text_value = text.partition("=")
+    if not key.isupper() or not hasattr(settings, key):
+        raise ValueError(f"{key} is not a setting")
+    if key in import_time_settings():
+        raise ValueError(f"{key} is read when the modules are imported, it cannot be overridden")
+    try:
+        value = ast.literal_eval(text_value)
+    except (ValueError, SyntaxError):
+        raise ValueError(f"{text_value!r} is not a literal value for {key}")
+    current = getattr(settings, key)
+    # A None setting takes any value, an int is accepted for a float
+    if current is not None and type(value) is not type(current) and not (type(current) is float and type(value) is int):
+        raise ValueError(f"{key} expects a {type(current).__name__}, not {text_value!r}")
+    return key, value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play many headless games in parallel")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="random")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--max-ticks", type=int, default=60 * TICK_RATE)
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a value of settings.py, e.g. --set ALIEN_SPEED=3")
+    parser.add_argument("--out", default="batch_results.npz", help="columnar output file")
+    args = parser.parse_args()
+    try:
+        overrides = dict(parse_override(text) for text in args.overrides)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    results = run_batch(args.games, args.policy, args.processes, args.seed, args.max_ticks, overrides)
+    elapsed = time.perf_counter() - start
+    np.savez(args.out, **results)
+    print(f"{args.games} games in {elapsed:.1f} s ({args.games / elapsed:.1f} games/s, "
+          f"{results['frames'].sum() / elapsed:.0f} frames/s) -> {args.out}")
+    print(f"mean score {results['score'].mean():.0f}, win rate {results['won'].mean():.1%}, "
+          f"mean frames {results['frames'].mean():.0f}")
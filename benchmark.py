@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import pygame
+
+from settings import *
+from sprites import Obstacle, LaserPool
+from collision import SpatialHash
+from replay import KeyState
+
+
+def obstacle_positions(rows: int) -> list:
+    """Positions of 'rows' rows of obstacles across the canvas."""
+    x_start = list(range(0, GAME_W - 50, 60))
+    return [(x, GAME_H - (row + 1) * 40) for row in range(rows) for x in x_start]
+
+
+def make_obstacles(rows: int) -> pygame.sprite.Group:
+    obstacles = pygame.sprite.Group()
+    positions = obstacle_positions(rows)
+    Obstacle(5).create_many_obstacles(obstacles, [x for x, _ in positions], [y for _, y in positions])
+    return obstacles
+
+
+def make_blocks(rows: int) -> pygame.sprite.Group:
+    """Reference obstacles: one 5x5 sprite per cell, as before the bunkers."""
+    blocks = pygame.sprite.Group()
+    obstacle_calc = Obstacle(5)
+    for x_start, y_start in obstacle_positions(rows):
+        for row_index, row in enumerate(obstacle_calc.shape):
+            for col_index, col in enumerate(row):
+                if col == "x":
+                    block = pygame.sprite.Sprite()
+                    block.rect = pygame.Rect(x_start + col_index * 5, y_start + row_index * 5, 5, 5)
+                    blocks.add(block)
+    return blocks
+
+
+def alive_cells(obstacles: pygame.sprite.Group) -> list:
+    cells = []
+    for bunker in obstacles:
+        size = bunker.block_size
+        for index, cell in enumerate(bunker.cells):
+            if cell:
+                row, col = divmod(index, bunker.cols)
+                cells.append((bunker.rect.x + col * size, bunker.rect.y + row * size, size, size))
+    return sorted(cells)
+
+
+def make_lasers(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    pool = LaserPool(n)
+    return [pool.fire((rng.randrange(GAME_W), rng.randrange(GAME_H)), -LASER_SPEED) for _ in range(n)]
+
+
+def bench_collisions(n_lasers: int, obstacle_rows: int, seed: int = 0) -> dict:
+    """Compare per-block pygame.sprite.spritecollide with the spatial hash over grid bunkers.
+
+    Both sides destroy what they hit; the hits and the remaining cells must be the same.
+    """
+    lasers = make_lasers(n_lasers, seed)
+
+    blocks = make_blocks(obstacle_rows)
+    n_blocks = len(blocks)
+    start = time.perf_counter()
+    brute_hits = [bool(pygame.sprite.spritecollide(laser, blocks, True)) for laser in lasers]
+    brute_time = time.perf_counter() - start
+
+    obstacles = make_obstacles(obstacle_rows)
+    start = time.perf_counter()
+    obstacles_hash = SpatialHash()
+    obstacles_hash.add(obstacles)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    hash_hits = []
+    for laser in lasers:
+        hit = False
+        for bunker in obstacles_hash.query(laser.rect):
+            hit = bunker.hit(laser.rect) or hit
+        hash_hits.append(hit)
+    hash_time = time.perf_counter() - start
+
+    assert brute_hits == hash_hits, "The spatial hash does not give the same collisions"
+    assert sorted(tuple(block.rect) for block in blocks) == alive_cells(obstacles), "The remaining cells differ"
+    return {
+        "lasers": n_lasers,
+        "blocks": n_blocks,
+        "brute_ms": brute_time * 1000,
+        "hash_ms": hash_time * 1000,
+        "build_ms": build_time * 1000,
+        "speedup": brute_time / hash_time if hash_time > 0 else float("inf"),
+    }
+
+
+def timed(fn, repeat: int, setup=None) -> dict:
+    """Call fn 'repeat' times (after setup, which is not timed) and return the median and p95 in ms."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {"median_ms": statistics.median(times) * 1000, "p95_ms": times[int(0.95 * (len(times) - 1))] * 1000}
+
+
+def new_world(game, seed: int = 0):
+    """A fresh GameWorld on top of the main menu of a headless game."""
+    from states import GameWorld
+    game.seed = seed
+    game.rng.seed(seed)
+    del game.state_stack[1:]
+    world = GameWorld(game)
+    world.enter_state()
+    return world
+
+
+def set_lasers(world, n: int, seed: int = 0) -> None:
+    """Replace the lasers of the world by n player lasers and n alien lasers spread over the canvas."""
+    rng = random.Random(seed)
+    player, wave = world.player.sprite, world.aliens_wave
+    for shooter, velocity in ((player, -LASER_SPEED), (wave, ALIEN_LASER_SPEED)):
+        if shooter.laser_pool.capacity < n:
+            shooter.laser_pool = LaserPool(n)
+            shooter.lasers = shooter.laser_pool.active
+        shooter.laser_pool.clear()
+        for _ in range(n):
+            shooter.laser_pool.fire((rng.randrange(GAME_W), rng.randrange(GAME_H)), velocity)
+
+
+def set_obstacles(world, rows: int) -> None:
+    positions = obstacle_positions(rows)
+    world.obstacles = pygame.sprite.Group()
+    Obstacle(5).create_many_obstacles(world.obstacles, [x for x, _ in positions], [y for _, y in positions])
+    world.obstacles_hash = SpatialHash()
+    world.obstacles_hash.add(world.obstacles)
+    world.obstacles_top = min(bunker.rect.top for bunker in world.obstacles)
+
+
+def bench_world(game, world, repeat: int, rows: int, cols: int, wave_args: dict = None, lasers: int = 0, obstacle_rows: int = 0) -> dict:
+    """Time the wave creation, the wave update, the collisions and a full-frame render of a world."""
+    wave = world.aliens_wave
+    wave_args = wave_args or {}
+
+    def reset() -> None:
+        wave.clear_wave()
+        wave.create_wave(rows, cols, **wave_args)
+        if obstacle_rows:
+            set_obstacles(world, obstacle_rows)
+        if lasers:
+            set_lasers(world, lasers)
+
+    results = {"wave_create": timed(lambda: wave.create_wave(rows, cols, **wave_args), repeat, wave.clear_wave)}
+    reset()
+    results["wave_update"] = timed(lambda: wave.update(game.dt), repeat)
+    # The collisions destroy what they hit: every run starts from the same world
+    results["check_collisions"] = timed(world.check_collisions, repeat, reset)
+    reset()
+    results["render"] = timed(lambda: world.render(game.game_canvas), repeat)
+    return results
+
+
+def scenario_default(game, repeat: int) -> dict:
+    """The 6x8 wave of the game."""
+    return bench_world(game, new_world(game), repeat, 6, 8)
+
+
+def scenario_wave_50x50(game, repeat: int) -> dict:
+    """2500 aliens packed over the canvas."""
+    return bench_world(game, new_world(game), repeat, 50, 50, {"x_dist": 10, "y_dist": 8, "x_start": 40, "y_start": 60})
+
+
+def scenario_swarm_10k(game, repeat: int) -> dict:
+    """Stress: 10000 aliens, batched rendering compared with one blit call per alien."""
+    world = new_world(game)
+    wave_args = {"x_dist": 5, "y_dist": 4, "x_start": 20, "y_start": 40}
+    results = bench_world(game, world, repeat, 100, 100, wave_args)
+    canvas = game.game_canvas
+    results["render_wave"] = timed(lambda: world.aliens_wave.render(canvas), repeat)
+    results["render_wave_per_sprite"] = timed(lambda: [canvas.blit(alien.image, alien.rect) for alien in world.aliens_wave.group], repeat)
+    return results
+
+
+def scenario_lasers(game, repeat: int) -> dict:
+    """500 player lasers and 500 alien lasers at once."""
+    return bench_world(game, new_world(game), repeat, 6, 8, lasers=500)
+
+
+def scenario_obstacle_rows(game, repeat: int) -> dict:
+    """Ten full rows of obstacles under 200 lasers of each side."""
+    world = new_world(game)
+    positions = obstacle_positions(10)
+    results = {"create_obstacles": timed(lambda: Obstacle(5).create_many_obstacles(
+        pygame.sprite.Group(), [x for x, _ in positions], [y for _, y in positions]), repeat)}
+    results.update(bench_world(game, world, repeat, 6, 8, lasers=200, obstacle_rows=10))
+    return results
+
+
+def scenario_soak(game, ticks: int = 20000) -> dict:
+    """Many ticks of games played by the tracker policy, restarted when they end.
+
+    The percentiles are taken over the individual ticks, --repeat does not apply.
+    """
+    from batch import tracker_policy
+    keys = KeyState()
+    game.input_keys = keys
+    policy_rng = random.Random(0)
+    world, seed = new_world(game), 0
+    times = []
+    peak_lasers = 0
+    for _ in range(ticks):
+        if game.state_stack[-1] is not world:
+            seed += 1
+            world = new_world(game, seed)
+        keys.bits = tracker_policy(world, policy_rng)
+        game.events = []
+        start = time.perf_counter()
+        game.update()
+        times.append(time.perf_counter() - start)
+        peak_lasers = max(peak_lasers, len(world.player.sprite.lasers) + len(world.aliens_wave.lasers))
+    game.input_keys = None
+    times.sort()
+    return {"tick": {"median_ms": statistics.median(times) * 1000, "p95_ms": times[int(0.95 * (len(times) - 1))] * 1000,
+                     "p99_ms": times[int(0.99 * (len(times) - 1))] * 1000, "max_ms": times[-1] * 1000,
+                     "games": seed + 1, "peak_lasers": peak_lasers}}
+
+
+SCENARIOS: dict = {
+    "default": scenario_default,
+    "wave_50x50": scenario_wave_50x50,
+    "swarm_10k": scenario_swarm_10k,
+    "lasers": scenario_lasers,
+    "obstacle_rows": scenario_obstacle_rows,
+    "soak": scenario_soak,
+}
+
+
+def run_suite(names: list = None, repeat: int = 50, soak_ticks: int = 20000, seed: int = 0) -> dict:
+    """Run the scenarios headlessly and return {'scenario.metric': stats}."""
+    from game import Game
+    game = Game(headless=True, seed=seed)
+    results = {}
+    for name in names or SCENARIOS:
+        if name == "soak":
+            scenario_results = scenario_soak(game, soak_ticks)
+        else:
+            scenario_results = SCENARIOS[name](game, repeat)
+        for metric, stats in scenario_results.items():
+            results[f"{name}.{metric}"] = stats
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, thresholds: dict = None, min_delta_ms: float = 0.) -> list:
+    """Return the metrics whose median is more than (1 + threshold) times the baseline one.
+
+    thresholds overrides the threshold of some metrics, by full name ('scenario.metric') or scenario.
+    Slowdowns under min_delta_ms are timing noise and ignored.
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        limit = thresholds.get(name, thresholds.get(name.split(".")[0], threshold))
+        reference = baseline[name]["median_ms"]
+        ratio = stats["median_ms"] / reference if reference > 0 else 1.
+        if ratio > 1 + limit and stats["median_ms"] - reference > min_delta_ms:
+            regressions.append((name, ratio, limit))
+    return regressions
+
+
+def print_collisions() -> None:
+    for n_lasers, obstacle_rows in [(10, 1), (100, 1), (100, 5), (500, 5), (1000, 10)]:
+        result = bench_collisions(n_lasers, obstacle_rows)
+        print(f"{result['lasers']:>5} lasers x {result['blocks']:>5} blocks: "
+              f"per-block spritecollide {result['brute_ms']:8.2f} ms | spatial hash + bunkers {result['hash_ms']:7.2f} ms "
+              f"(+{result['build_ms']:.2f} ms build) | x{result['speedup']:.1f}")
+
+
+def parse_threshold(text: str) -> tuple:
+    name, value = text.split("=", 1)
+    return name, float(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless benchmark scenarios, compared with a baseline")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run among {', '.join(SCENARIOS)} (all by default)")
+    parser.add_argument("--repeat", type=int, default=50, help="runs of each measure (the soak is timed per tick)")
+    parser.add_argument("--soak-ticks", type=int, default=20000)
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown of the medians, 0.2 for +20%%")
+    parser.add_argument("--set-threshold", dest="thresholds", action="append", default=[], metavar="NAME=VALUE",
+                        help="threshold of a scenario or a metric, e.g. --set-threshold soak=0.5")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    parser.add_argument("--collisions", action="store_true", help="compare the spatial hash with spritecollide instead")
+    args = parser.parse_args()
+
+    if args.collisions:
+        print_collisions()
+        raise SystemExit
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = run_suite(args.scenarios, args.repeat, args.soak_ticks)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+    for name, stats in results.items():
+        line = f"{name:<32} median {stats['median_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms"
+        if name in baseline:
+            line += f"  ({stats['median_ms'] / baseline[name]['median_ms'] - 1:+.0%} vs baseline)" if baseline[name]["median_ms"] > 0 else ""
+        print(line)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({**baseline, **results}, file, indent=4)
+        print(f"Baseline saved in {args.baseline}")
+    elif baseline:
+        regressions = compare(results, baseline, args.threshold, dict(parse_threshold(text) for text in args.thresholds),
+                              args.min_delta_ms)
+        for name, ratio, limit in regressions:
+            print(f"REGRESSION {name}: x{ratio:.2f} (allowed x{1 + limit:.2f})")
+        raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,97 @@
+import pygame
+
+
+class SpatialHash():
+    """Uniform grid broad-phase over the game canvas.
+
+    Every sprite is registered in all the cells its rect overlaps. A collision
+    query only runs the narrow-phase (rect test) on the sprites sharing a cell
+    with the tested rect. Sprites killed elsewhere are dropped lazily, the next
+    time a query meets them.
+    """
+    def __init__(self, cell_size: int = 32) -> None:
+        self.cell_size: int = cell_size
+        self.cells: dict = {}
+        # Sprite -> (x0, y0, x1, y1) range of cells it is registered in
+        self.sprite_cells: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.sprite_cells)
+
+    def cell_range(self, rect: pygame.Rect) -> tuple:
+        size = self.cell_size
+        return (rect.left // size, rect.top // size, (rect.right - 1) // size, (rect.bottom - 1) // size)
+
+    def _register(self, sprite, cell_range: tuple) -> None:
+        x0, y0, x1, y1 = cell_range
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self.cells.setdefault((cx, cy), set()).add(sprite)
+        self.sprite_cells[sprite] = cell_range
+
+    def _unregister(self, sprite, cell_range: tuple) -> None:
+        x0, y0, x1, y1 = cell_range
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(sprite)
+                    if not cell:
+                        del self.cells[(cx, cy)]
+
+    def add(self, sprites) -> None:
+        for sprite in sprites:
+            self.move(sprite)
+
+    def remove(self, sprite) -> None:
+        cell_range = self.sprite_cells.pop(sprite, None)
+        if cell_range is not None:
+            self._unregister(sprite, cell_range)
+
+    def move(self, sprite) -> None:
+        """Insert the sprite or update its cells if it has changed of cells."""
+        new_range = self.cell_range(sprite.rect)
+        old_range = self.sprite_cells.get(sprite)
+        if new_range == old_range:
+            return
+        if old_range is not None:
+            self._unregister(sprite, old_range)
+        self._register(sprite, new_range)
+
+    def sync(self, group: pygame.sprite.AbstractGroup) -> None:
+        """Follow a group of moving sprites: move the alive ones, drop the dead."""
+        for sprite in group:
+            self.move(sprite)
+        if len(self.sprite_cells) > len(group):
+            for sprite in [sprite for sprite in self.sprite_cells if not sprite.alive()]:
+                self.remove(sprite)
+
+    def query(self, rect: pygame.Rect) -> list:
+        """Return the alive sprites sharing at least one cell with rect."""
+        x0, y0, x1, y1 = self.cell_range(rect)
+        candidates: list = []
+        seen: set = set()
+        dead: list = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                for sprite in self.cells.get((cx, cy), ()):
+                    if sprite in seen:
+                        continue
+                    seen.add(sprite)
+                    if sprite.alive():
+                        candidates.append(sprite)
+                    else:
+                        dead.append(sprite)
+        for sprite in dead:
+            self.remove(sprite)
+        return candidates
+
+    def spritecollide(self, sprite, dokill: bool) -> list:
+        """Same as pygame.sprite.spritecollide, restricted to the broad-phase candidates."""
+        rect = sprite.rect
+        collided = [candidate for candidate in self.query(rect) if rect.colliderect(candidate.rect)]
+        if dokill:
+            for candidate in collided:
+                candidate.kill()
+                self.remove(candidate)
+        return collided
@@ -0,0 +1,143 @@
+import numpy as np
+import pygame
+
+from settings import *
+from replay import KeyState, KEY_BITS
+
+
+LEFT, RIGHT, SPACE = KEY_BITS[pygame.K_LEFT], KEY_BITS[pygame.K_RIGHT], KEY_BITS[pygame.K_SPACE]
+# Discrete actions: noop, left, right, fire, left + fire, right + fire
+ACTIONS: tuple = (0, LEFT, RIGHT, SPACE, LEFT | SPACE, RIGHT | SPACE)
+
+# Observation layout
+WAVE_ROWS: int = 6
+WAVE_COLS: int = 8
+MAX_ALIEN_LASERS: int = 8
+MAX_PLAYER_LASERS: int = 4
+OBS_SIZE: int = 3 + 3 + WAVE_ROWS * WAVE_COLS + 2 * MAX_ALIEN_LASERS + 2 * MAX_PLAYER_LASERS + 2
+
+
+class SpaceInvadersEnv():
+    """Gym-style environment over a headless GameWorld.
+
+    reset() -> observation
+    step(action) -> observation, reward, done, info
+
+    The reward is the score gained during the step (Game.update_score) and the
+    episode is done when the world is left for a failure or a win, or after max_steps.
+    The observation is a float32 vector of size OBS_SIZE:
+        - player: x, ready, lives
+        - wave: x, y of the first alien, direction, alive mask (rows x cols)
+        - alien lasers: x, y of the lowest ones
+        - player lasers: x, y
+        - extra: present, x
+    """
+    def __init__(self, seed: int = None, max_steps: int = 60 * 60 * TICK_RATE) -> None:
+        from game import Game
+        self.game = Game(headless=True, seed=seed)
+        self.keys = KeyState()
+        self.game.input_keys = self.keys
+        self.max_steps: int = max_steps
+        self.world = None
+
+    def reset(self, seed: int = None) -> np.ndarray:
+        from states import GameWorld
+        if seed is not None:
+            self.game.seed = seed
+            self.game.rng.seed(seed)
+        del self.game.state_stack[1:]
+        self.world = GameWorld(self.game)
+        self.world.enter_state()
+        assert hasattr(self.world.aliens_wave, "alive"), "The environment needs VECTORIZED_WAVE"
+        self.steps: int = 0
+        return self.observe()
+
+    def step(self, action: int) -> tuple:
+        reward, done, info = self.advance(action)
+        return self.observe(), reward, done, info
+
+    def advance(self, action: int) -> tuple:
+        """Step the world without building the observation, return reward, done, info."""
+        score = self.game.score
+        self.keys.bits = ACTIONS[action]
+        self.game.events = []
+        self.game.update()
+        self.steps += 1
+
+        from states import WinState
+        ended = self.game.state_stack[-1] is not self.world
+        won = ended and isinstance(self.game.state_stack[-1], WinState)
+        done = ended or self.steps >= self.max_steps
+        info = {"score": self.game.score, "lives": self.world.player.sprite.lives, "won": won,
+                "truncated": done and not ended}
+        return float(self.game.score - score), done, info
+
+    def observe(self, out: np.ndarray = None) -> np.ndarray:
+        """Write the observation in out (allocated if None) and return it."""
+        if out is None:
+            out = np.empty(OBS_SIZE, dtype=np.float32)
+        out.fill(0.)
+        player = self.world.player.sprite
+        out[0:3] = (player.rect.centerx / GAME_W, player.ready, player.lives / LIVES)
+
+        wave = self.world.aliens_wave
+        i = 3
+        if len(wave.x):
+            out[i:i + 3] = (wave.x[0] / GAME_W, wave.y[0] / GAME_H, wave.wave_dir)
+            n = min(len(wave.alive), WAVE_ROWS * WAVE_COLS)
+            out[i + 3:i + 3 + n] = wave.alive[:n]
+        i += 3 + WAVE_ROWS * WAVE_COLS
+
+        lasers = sorted(wave.lasers, key=lambda laser: -laser.rect.bottom)[:MAX_ALIEN_LASERS]
+        for j, laser in enumerate(lasers):
+            out[i + 2 * j:i + 2 * j + 2] = (laser.rect.centerx / GAME_W, laser.rect.centery / GAME_H)
+        i += 2 * MAX_ALIEN_LASERS
+
+        for j, laser in enumerate(player.lasers.sprites()[:MAX_PLAYER_LASERS]):
+            out[i + 2 * j:i + 2 * j + 2] = (laser.rect.centerx / GAME_W, laser.rect.centery / GAME_H)
+        i += 2 * MAX_PLAYER_LASERS
+
+        if self.world.extra.sprite is not None:
+            out[i:i + 2] = (1., self.world.extra.sprite.rect.centerx / GAME_W)
+        return out
+
+
+class VectorEnv():
+    """Step N environments in lockstep and return batched arrays.
+
+    The output arrays are allocated once and filled in place at every step.
+    A finished environment is reset automatically: its row holds the first
+    observation of the next episode and its done flag is set.
+    """
+    def __init__(self, n: int, seed: int = 0, max_steps: int = 60 * 60 * TICK_RATE) -> None:
+        self.envs: list = [SpaceInvadersEnv(seed + i, max_steps) for i in range(n)]
+        self.seed: int = seed
+        self.episodes: int = 0
+        self.observations = np.zeros((n, OBS_SIZE), dtype=np.float32)
+        self.rewards = np.zeros(n, dtype=np.float32)
+        self.dones = np.zeros(n, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.envs)
+
+    def next_seed(self) -> int:
+        seed = self.seed + self.episodes
+        self.episodes += 1
+        return seed
+
+    def reset(self) -> np.ndarray:
+        for i, env in enumerate(self.envs):
+            env.reset(self.next_seed())
+            env.observe(self.observations[i])
+        return self.observations
+
+    def step(self, actions) -> tuple:
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            self.rewards[i], self.dones[i], info = env.advance(int(action))
+            done = self.dones[i]
+            if done:
+                env.reset(self.next_seed())
+            env.observe(self.observations[i])
+            infos.append(info)
+        return self.observations, self.rewards, self.dones, infos
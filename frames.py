@@ -0,0 +1,71 @@
+import numpy as np
+import pygame
+
+from contextlib import contextmanager
+
+
+class FrameExporter():
+    """Export the pixels of a surface (the game canvas) as NumPy arrays.
+
+    view() gives a zero-copy (H, W, 3) view of the surface pixels through
+    surfarray. The surface is locked while the view exists, so it must be released
+    before the next render.
+    capture() fills preallocated buffers with the frame, optionally downsampled
+    by an integer factor and/or converted to grayscale, and returns them: no
+    array is allocated per frame. The returned array is overwritten by the next call.
+    """
+    # Integer luma weights, they sum to 256
+    GRAY_WEIGHTS: tuple = (77, 150, 29)
+
+    def __init__(self, surface: pygame.Surface, grayscale: bool = False, downsample: int = 1) -> None:
+        assert downsample >= 1
+        self.surface = surface
+        self.grayscale: bool = grayscale
+        self.downsample: int = downsample
+        w, h = surface.get_size()
+        w, h = -(-w // downsample), -(-h // downsample)
+        # surfarray is indexed (x, y): the buffers are stored (W, H) and returned transposed
+        if grayscale:
+            self.buffer = np.empty((w, h), dtype=np.uint8)
+            self.acc = np.empty((w, h), dtype=np.uint16)
+            self.tmp = np.empty((w, h), dtype=np.uint16)
+            self.frame = self.buffer.T
+        else:
+            self.buffer = np.empty((w, h, 3), dtype=np.uint8)
+            self.frame = self.buffer.transpose(1, 0, 2)
+
+    @property
+    def shape(self) -> tuple:
+        return self.frame.shape
+
+    @contextmanager
+    def view(self):
+        """Zero-copy (H, W, 3) view of the surface, valid inside the with block."""
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        try:
+            yield pixels.transpose(1, 0, 2)
+        finally:
+            # Unlock the surface
+            del pixels
+
+    def capture(self) -> np.ndarray:
+        """Copy the current frame into the preallocated buffer and return it as (H, W[, 3])."""
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        source = None
+        try:
+            k = self.downsample
+            source = pixels[::k, ::k] if k > 1 else pixels
+            if self.grayscale:
+                red, green, blue = self.GRAY_WEIGHTS
+                np.multiply(source[..., 0], red, out=self.acc, dtype=np.uint16)
+                np.multiply(source[..., 1], green, out=self.tmp, dtype=np.uint16)
+                self.acc += self.tmp
+                np.multiply(source[..., 2], blue, out=self.tmp, dtype=np.uint16)
+                self.acc += self.tmp
+                np.right_shift(self.acc, 8, out=self.acc)
+                np.copyto(self.buffer, self.acc, casting="unsafe")
+            else:
+                np.copyto(self.buffer, source)
+        finally:
+            del pixels, source
+        return self.frame
@@ -1,36 +1,93 @@
+import os
+import math
+import random
 import pygame
-import json
 import time
 
 
 from settings import *
-from states import State, MainMenu
+from assets import AssetManager
+from audio import SoundDispatcher
+from ranking import RankingStore, ScoreWriter
+from profiler import FrameProfiler, ProfilerOverlay, resident_memory
+from simulation import SimulationThread
+from states import State, MainMenu, GameWorld
 
 
 class Game():
-    def __init__(self) -> None:
-        pygame.init()
+    def __init__(self, headless: bool = False, seed: int = None) -> None:
+        self.start_time: float = time.perf_counter()
+        self.first_frame_time = None
+        self.headless: bool = headless
+        # The video driver is chosen when the display is initialised: switch it
+        # if a previous Game of the process left the other one
+        on_dummy = pygame.display.get_init() and pygame.display.get_driver() == "dummy"
+        if on_dummy != (self.headless or os.environ.get("SDL_VIDEODRIVER") == "dummy"):
+            pygame.display.quit()
+        if self.headless:
+            # No window and no mixer: only what the simulation needs. The dummy
+            # driver is only asked for this init, not for the rest of the process
+            previous = os.environ.get("SDL_VIDEODRIVER")
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            try:
+                pygame.display.init()
+            finally:
+                if previous is None:
+                    del os.environ["SDL_VIDEODRIVER"]
+                else:
+                    os.environ["SDL_VIDEODRIVER"] = previous
+            pygame.font.init()
+        else:
+            pygame.init()
 
         # Screen
         self.game_canvas = pygame.Surface((GAME_W, GAME_H))
-        self.screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
-        pygame.display.set_caption("Space Invaders")
+        self.screen = None
+        if not self.headless:
+            self.screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
+            pygame.display.set_caption("Space Invaders")
 
         # Time
-        self.dt = time.time()
-        self.prev_dt = self.dt
+        # The simulation runs at a fixed timestep, the frames at their own pace
+        self.dt: float = 1 / TICK_RATE
+        self.frame_dt: float = 0.
+        self.prev_time: float = time.perf_counter()
+        self.accumulator: float = 0.
+        self.alpha: float = 1.
         self.clock = pygame.time.Clock()
 
         # Events
         self.events = None
+        self.pending_events: list = []
+
+        # Inputs: the keyboard unless replayed keys are given
+        self.input_keys = None
+        self.recorder = None
+
+        # Randomness of the gameplay
+        self.seed: int = seed if seed is not None else random.randrange(2**63)
+        self.rng = random.Random(self.seed)
+
+        # Rendering
+        self.rendered_state = None
+        # Optional simulation thread, see threaded_loop
+        self.simulation = None
+        # Optional SpectatorServer, fed by GameWorld.update
+        self.spectators = None
+
+        # Profiling, F3 shows the overlay
+        self.profiler = FrameProfiler(PROFILER_FRAMES)
+        # Profiler of the simulation phases, the simulation thread has its own
+        self.tick_profiler: FrameProfiler = self.profiler
+        self.profile_always: bool = False
+        self.overlay = None
 
         # Load Assets
         self.load_assets()
 
-        # Play the background
-        self.bg_music = pygame.mixer.Sound(self.audio_dir + '/music.wav')
-        self.bg_music.set_volume(0.05)
-        self.bg_music.play(loops=-1)
+        # Play the background, streamed from the file
+        if not self.headless:
+            self.assets.play_music('music.wav', 0.05)
 
         # Data which need to be stored
         self.player_name = "player"
@@ -44,48 +101,249 @@ class Game():
         self.init_state()
     
     def game_loop(self):
+        if self.simulation is not None:
+            return self.threaded_loop()
 
+        self.prev_time = time.perf_counter()
+        profiler = self.profiler
+        profiler.begin_frame()
         while self.playing:
             # Update time
             self.get_dt()
-            # Update events
-            self.events = pygame.event.get()
-            # Update state
-            self.update()
-            # Render state
+            # Update events, kept until the next simulation tick
+            profiler.start("events")
+            events = pygame.event.get()
+            self.pending_events += events
+            profiler.stop("events")
+            for event in events:
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    self.toggle_overlay()
+            # Update state at a fixed timestep
+            profiler.start("update")
+            self.accumulator += self.frame_dt
+            ticks: int = 0
+            while self.accumulator >= self.dt and ticks < MAX_TICKS_PER_FRAME:
+                self.events, self.pending_events = self.pending_events, []
+                self.update()
+                self.accumulator -= self.dt
+                ticks += 1
+            # Too slow to catch up: drop the late ticks instead of spiralling
+            if ticks == MAX_TICKS_PER_FRAME:
+                self.accumulator = min(self.accumulator, self.dt)
+            profiler.stop("update")
+            # Render state between the last two ticks
+            self.alpha = self.accumulator / self.dt
             self.render()
+            if self.first_frame_time is None:
+                self.report_startup()
             # FPS
+            profiler.start("wait")
             self.clock.tick(FRAMERATE)
+            profiler.stop("wait")
+            profiler.end_frame()
+
+    def threaded_loop(self):
+        """Poll the inputs and render while the simulation runs on its own thread.
+
+        The frames are drawn from the snapshots published by the simulation, so a
+        slow scale or flip never delays a tick and the other way around.
+        """
+        profiler = self.profiler
+        profiler.begin_frame()
+        self.simulation.start()
+        try:
+            while self.playing:
+                profiler.start("events")
+                events = pygame.event.get()
+                self.simulation.send(events, pygame.key.get_pressed())
+                profiler.stop("events")
+                for event in events:
+                    if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                        self.toggle_overlay()
+                self.render()
+                if self.first_frame_time is None:
+                    self.report_startup()
+                profiler.start("wait")
+                self.clock.tick(FRAMERATE)
+                profiler.stop("wait")
+                profiler.end_frame()
+        finally:
+            self.simulation.stop()
+
+    def run_headless(self, frames: int) -> float:
+        """Simulate a GameWorld as fast as possible.
+
+        Nothing is rendered and the loop is not capped. It stops after 'frames'
+        updates or as soon as the world is left (game over, win or quit).
+        Returns the number of simulated frames per second.
+        """
+        world = GameWorld(self)
+        world.enter_state()
+        self.frames_simulated = 0
+        start = time.perf_counter()
+        self.profiler.begin_frame()
+        while self.running and self.frames_simulated < frames and self.state_stack[-1] is world:
+            self.events = pygame.event.get()
+            self.profiler.start("update")
+            self.update()
+            self.profiler.stop("update")
+            self.profiler.end_frame()
+            self.frames_simulated += 1
+        elapsed = time.perf_counter() - start
+        self.laser_stats = {"player": world.player.sprite.laser_pool.stats(), "aliens": world.aliens_wave.laser_pool.stats()}
+        return self.frames_simulated / elapsed if elapsed > 0 else float("inf")
     
     def get_dt(self):
-        now = time.time()
-        self.dt = now - self.prev_dt
-        self.prev_dt = now
+        """Measure the duration of the last frame with a monotonic clock."""
+        now = time.perf_counter()
+        self.frame_dt = now - self.prev_time
+        self.prev_time = now
     
+    def get_keys(self):
+        if self.input_keys is not None:
+            return self.input_keys
+        return pygame.key.get_pressed()
+
     def update(self):
         self.state_stack[-1].update(self.dt, self.events)
     
     def render(self):
-        self.state_stack[-1].render(self.game_canvas)
-        self.screen.blit(pygame.transform.scale(self.game_canvas, (SCREEN_W, SCREEN_H)), (0, 0))
-        pygame.display.flip()
+        self.profiler.start("render")
+        rects = self.render_offscreen()
+        self.profiler.stop("render")
+        # Headless: the canvas is the only output
+        if self.screen is None:
+            return
+
+        if rects is None:
+            self.profiler.start("scale")
+            self.screen.blit(pygame.transform.scale(self.game_canvas, (SCREEN_W, SCREEN_H)), (0, 0))
+            if self.overlay is not None:
+                self.overlay.draw(self.screen)
+            self.profiler.stop("scale")
+            self.profiler.start("flip")
+            pygame.display.flip()
+            self.profiler.stop("flip")
+        else:
+            self.present(rects)
+
+    def toggle_overlay(self) -> None:
+        """Show or hide the profiler overlay, the profiler runs while it is shown."""
+        if self.overlay is None:
+            self.overlay = ProfilerOverlay(self.profiler, self.tick_profiler)
+            self.profiler.enabled = True
+        else:
+            self.overlay = None
+            self.profiler.enabled = self.profile_always
+        self.tick_profiler.enabled = self.profiler.enabled
+        self.profiler.begin_frame()
+        # The overlay is drawn over the screen: redraw everything
+        self.rendered_state = None
+
+    def render_offscreen(self):
+        """Render the active state on the game canvas only.
+
+        Returns the changed regions of the canvas, None if it has been entirely redrawn.
+        """
+        if self.simulation is not None:
+            return self.render_snapshot()
+        state = self.state_stack[-1]
+        # A new state is always drawn entirely
+        if DIRTY_RENDERING and state is self.rendered_state:
+            rects = state.render_dirty(self.game_canvas)
+        else:
+            state.render(self.game_canvas)
+            rects = None
+        self.rendered_state = state
+        return rects
+
+    def render_snapshot(self):
+        """Render the last snapshot of the simulation thread, always entirely."""
+        snapshot = self.simulation.latest()
+        if snapshot is None:
+            return None
+        if snapshot.world is None:
+            # A live state: not while a tick changes it, and only if it is still the active one
+            with self.simulation.lock:
+                if snapshot.state is not self.state_stack[-1]:
+                    return None
+                snapshot.state.render(self.game_canvas)
+        else:
+            snapshot.state.render_snapshot(self.game_canvas, snapshot.world, self.simulation.alpha(snapshot))
+        self.rendered_state = snapshot.state
+        return None
+
+    def present(self, rects: list) -> None:
+        """Scale and push only the given regions of the game canvas."""
+        canvas = self.game_canvas.get_rect()
+        # Too many small regions cost more than one big one
+        if len(rects) > MAX_DIRTY_RECTS:
+            rects = [rects[0].unionall(rects[1:])]
+        scale_x, scale_y = SCREEN_W / GAME_W, SCREEN_H / GAME_H
+        self.profiler.start("scale")
+        screen_rects = []
+        for rect in rects:
+            # One pixel margin for the scaling filter
+            rect = rect.inflate(2, 2).clip(canvas)
+            if not rect.width or not rect.height:
+                continue
+            left, top = int(rect.left * scale_x), int(rect.top * scale_y)
+            right, bottom = math.ceil(rect.right * scale_x), math.ceil(rect.bottom * scale_y)
+            target = pygame.Rect(left, top, right - left, bottom - top)
+            self.screen.blit(pygame.transform.scale(self.game_canvas.subsurface(rect), target.size), target)
+            screen_rects.append(target)
+        if self.overlay is not None:
+            screen_rects.append(self.overlay.draw(self.screen))
+        self.profiler.stop("scale")
+        self.profiler.start("flip")
+        if screen_rects:
+            pygame.display.update(screen_rects)
+        self.profiler.stop("flip")
 
     def load_assets(self) -> None:
         self.assets_dir: str = "./assets"
         self.graphics_dir: str = self.assets_dir + "/graphics"
         self.audio_dir: str = self.assets_dir + "/audio"
-        self.font = pygame.font.Font(self.assets_dir + '/font/Pixeled.ttf', FONTSIZE)
+        # Each asset is decoded once and shared by all the sprites
+        self.assets = AssetManager(self.assets_dir, max_items=ASSET_CACHE_SIZE)
+        # The menu only needs the font and its background
+        self.font = self.assets.font('Pixeled.ttf', FONTSIZE)
+        self.assets.image("tv.png")
+        # The gameplay assets are loaded while the menu is already running
+        gameplay_images, gameplay_sounds = ["player.png", "yellow.png", "green.png", "red.png", "extra.png"], {"laser.wav": 0.1, "explosion.wav": 0.1}
+        if self.headless:
+            self.assets.preload(gameplay_images, gameplay_sounds)
+        else:
+            self.assets.preload_async(gameplay_images, gameplay_sounds)
+
+        # Every sound goes through the dispatcher, within MIXER_CHANNELS voices
+        self.audio = SoundDispatcher(self.assets)
+        self.audio.register("player_laser", "laser.wav", 0.1, max_voices=1, priority=2, reserved=True)
+        self.audio.register("alien_laser", "laser.wav", 0.1, max_voices=3, priority=1, min_interval_ms=50)
+        self.audio.register("explosion", "explosion.wav", 0.1, max_voices=4, priority=1, min_interval_ms=30)
+
+    def report_startup(self) -> None:
+        """Print the time to the first frame and the resident memory."""
+        self.first_frame_time = time.perf_counter() - self.start_time
+        assets = "loaded" if self.assets.loaded() else "loading in background"
+        print(f"First frame after {self.first_frame_time * 1000:.0f} ms, "
+              f"{resident_memory() / 2**20:.1f} MB resident (gameplay assets {assets})")
 
     def init_state(self):
         self.state_stack.append(MainMenu(self))
     
     def reset_score(self):
         self.score = 0
+        self.score_saved = False
 
     def update_score(self, add_value):
         self.score += add_value
 
     def save_score(self):
+        # Save a game only once, and never the simulated ones
+        if self.score_saved or self.headless:
+            return
+        self.score_saved = True
         self.sl_manager.save_data((self.player_name, self.score))
 
     def load_score(self):
@@ -98,51 +356,104 @@ class SaveLoadManager():
     # Remember the name and the associated score
     def __init__(self):
         self.filename = SAVE_FILE
+        self.db_filename = RANKING_DB
         self.ranking = {}
         self.TOP_N = 10
-    
-    def sorted_ranking(self, ranking):
-        return dict(sorted(ranking.items(), key=lambda item: item[1]))
+        # Opened on first use
+        self.store = None
+        self.writer = None
+
+    def start_writer(self) -> ScoreWriter:
+        if self.writer is None:
+            # The writer opens the database and imports the former JSON ranking on its thread
+            self.writer = ScoreWriter(self.db_filename, migrate=self.filename)
+        return self.writer
+
+    def open_store(self) -> RankingStore:
+        if self.store is None:
+            # Once the writer has created and migrated the database
+            self.start_writer().flush()
+            self.store = RankingStore(self.db_filename)
+        return self.store
 
     def load_data(self):
-        try:
-            with open(self.filename, "r+") as file:
-                self.ranking = json.load(file)
-                self.update_ranking(self.ranking)
-        except:
-            pass
+        """Load the top 10, sorted by ascending score."""
+        store = self.open_store()
+        # Wait for the scores still being written
+        self.writer.flush()
+        self.ranking = dict(reversed(store.top(self.TOP_N)))
     
     def save_data(self, data):
-        """Add the new data to the current ranking."""
-        self.update_ranking(data)
-        with open(self.filename, "w+") as file:
-            json.dump(self.ranking, file)
-
-    def update_ranking(self, data):
-        """Check if the new data can be integrated into the ranking
-        
-        Add the new data and sort the ranking. Then, keep the 10 best.
-        Args:
-            data, a tuple (name, score)
-        """
-        # If the player already exists
-        if data[0] in self.ranking.keys():
-            # Check if the new score is greater than before
-            if data[1] > self.ranking[data[0]]:
-                self.ranking[data[0]] = data[1]
-        else:
-            self.ranking[data[0]] = data[1]
-        # Sorted the ranking and keep the 10 best
-        self.ranking = self.sorted_ranking(self.ranking)
-        self.ranking = {kv[0]:kv[1] for i, kv in enumerate(self.ranking.items()) if i <= self.TOP_N}
+        """Add the new data (name, score) to the ranking, without blocking.
+
+        The score is written by a background thread."""
+        self.start_writer().submit(*data)
+
+    def close(self) -> None:
+        """Flush the pending scores."""
+        if self.writer is not None:
+            self.writer.close()
 
 
 if __name__ == "__main__":
-    g = Game()
+    import argparse
+    parser = argparse.ArgumentParser(description="Space Invaders")
+    parser.add_argument("--headless", action="store_true", help="simulate without display, audio or frame cap")
+    parser.add_argument("--frames", type=int, default=10000, help="number of frames to simulate in headless mode")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the gameplay randomness")
+    parser.add_argument("--record", metavar="PATH", default=None, help="record the inputs of the first game (see replay.py)")
+    parser.add_argument("--threaded", action="store_true", default=THREADED_SIMULATION,
+                        help="run the simulation on its own thread, the main thread only renders")
+    parser.add_argument("--profile", metavar="PATH", default=None,
+                        help="profile every frame and export the last ones at exit (Chrome trace if .json, CSV otherwise)")
+    parser.add_argument("--spectate", metavar="PORT", type=int, nargs="?", const=SPECTATOR_PORT, default=None,
+                        help=f"stream the game to local viewers (see spectator.py), on port {SPECTATOR_PORT} by default")
+    args = parser.parse_args()
+
+    def start_spectators(game) -> None:
+        if args.spectate is not None:
+            from spectator import SpectatorServer
+            game.spectators = SpectatorServer(port=args.spectate)
+            game.spectators.start()
+            print(f"Spectators: {game.spectators.host}:{game.spectators.port}")
+
+    if args.headless:
+        g = Game(headless=True, seed=args.seed)
+        g.profiler.enabled = g.profile_always = args.profile is not None
+        start_spectators(g)
+        fps = g.run_headless(args.frames)
+        if g.spectators is not None:
+            g.spectators.stop()
+        print(f"Simulated {g.frames_simulated} frames at {fps:.0f} frames/s (score: {g.score})")
+        for shooter, stats in g.laser_stats.items():
+            print(f"{shooter} lasers: {stats['live']} live, peak {stats['peak']}/{stats['capacity']}, {stats['dropped']} dropped")
+        if args.profile:
+            g.profiler.export(args.profile)
+        raise SystemExit
+
+    g = Game(seed=args.seed)
+    if args.threaded:
+        g.simulation = SimulationThread(g)
+    g.profiler.enabled = g.profile_always = args.profile is not None
+    start_spectators(g)
+    if args.record:
+        from replay import Recorder
+        g.recorder = Recorder(args.record, g.seed)
 
     while g.running:
         g.playing = True
         g.game_loop()
 
+    if g.recorder is not None:
+        g.recorder.stop()
+    if g.spectators is not None:
+        g.spectators.stop()
+    if args.profile:
+        g.profiler.export(args.profile)
+        if g.simulation is not None:
+            root, ext = os.path.splitext(args.profile)
+            g.simulation.profiler.export(f"{root}.simulation{ext}")
+    g.sl_manager.close()
+
 
     
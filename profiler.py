@@ -0,0 +1,177 @@
+import csv
+import json
+import os
+import sys
+import time
+import numpy as np
+import pygame
+
+
+# Phases of a frame, the simulation ones are nested in 'update'
+PHASES: tuple = ("events", "update", "aliens", "player", "collisions", "render", "scale", "flip", "wait")
+
+
+def resident_memory() -> int:
+    """Resident set size of the process in bytes, 0 if unknown."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # Peak resident size: kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class FrameProfiler():
+    """Per-phase timings of the last frames, kept in a ring buffer.
+
+    start(phase) / stop(phase) accumulate the time spent in a phase during the
+    current frame, end_frame() stores the frame. A phase run several times in a
+    frame (e.g. several ticks) is summed and keeps its first start time.
+    When disabled, start() and stop() only check a flag.
+    """
+    def __init__(self, capacity: int = 600, enabled: bool = False) -> None:
+        self.capacity: int = capacity
+        self.enabled: bool = enabled
+        self.index: dict = {phase: i for i, phase in enumerate(PHASES)}
+        # Ring buffer: frame start, frame duration and per-phase (first start, total duration)
+        self.frame_starts = np.zeros(capacity)
+        self.frame_times = np.zeros(capacity)
+        self.phase_starts = np.zeros((capacity, len(PHASES)))
+        self.phase_times = np.zeros((capacity, len(PHASES)))
+        self.frames: int = 0
+        self.origin: float = time.perf_counter()
+        self.frame_start: float = self.origin
+        self.open: dict = {}
+        self.starts: list = [0.] * len(PHASES)
+        self.times: list = [0.] * len(PHASES)
+
+    def __len__(self) -> int:
+        return min(self.frames, self.capacity)
+
+    def begin_frame(self) -> None:
+        self.frame_start = time.perf_counter()
+        self.open.clear()
+        self.starts = [0.] * len(PHASES)
+        self.times = [0.] * len(PHASES)
+
+    def start(self, phase: str) -> None:
+        if self.enabled:
+            self.open[phase] = time.perf_counter()
+
+    def stop(self, phase: str) -> None:
+        if self.enabled:
+            now = time.perf_counter()
+            start = self.open.pop(phase, now)
+            i = self.index[phase]
+            if not self.times[i]:
+                self.starts[i] = start
+            self.times[i] += now - start
+
+    def end_frame(self) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        row = self.frames % self.capacity
+        self.frame_starts[row] = self.frame_start - self.origin
+        self.frame_times[row] = now - self.frame_start
+        self.phase_starts[row] = self.starts
+        self.phase_starts[row] -= self.origin
+        self.phase_times[row] = self.times
+        self.frames += 1
+        self.begin_frame()
+
+    def ordered(self, array: np.ndarray) -> np.ndarray:
+        """Rows of a ring buffer array, oldest first."""
+        if self.frames <= self.capacity:
+            return array[:self.frames]
+        row = self.frames % self.capacity
+        return np.concatenate((array[row:], array[:row]))
+
+    def summary(self) -> dict:
+        """Frame time percentiles and mean time per phase, in ms."""
+        if not len(self):
+            return {}
+        frame_times = self.frame_times[:len(self)] * 1000
+        p50, p95, p99 = np.percentile(frame_times, (50, 95, 99)).tolist()
+        phase_means = self.phase_times[:len(self)].mean(axis=0) * 1000
+        return {"frames": len(self), "p50": p50, "p95": p95, "p99": p99, "max": float(frame_times.max()),
+                "phases": dict(zip(PHASES, phase_means.tolist()))}
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Write the frames as a Chrome trace (chrome://tracing, Perfetto)."""
+        events = []
+        frame_starts, frame_times = self.ordered(self.frame_starts), self.ordered(self.frame_times)
+        phase_starts, phase_times = self.ordered(self.phase_starts), self.ordered(self.phase_times)
+        first = self.frames - len(self)
+        for n in range(len(self)):
+            events.append({"name": "frame", "ph": "X", "pid": 0, "tid": 0, "args": {"frame": first + n},
+                           "ts": frame_starts[n] * 1e6, "dur": frame_times[n] * 1e6})
+            for i, phase in enumerate(PHASES):
+                if phase_times[n, i]:
+                    events.append({"name": phase, "ph": "X", "pid": 0, "tid": 0,
+                                   "ts": phase_starts[n, i] * 1e6, "dur": phase_times[n, i] * 1e6})
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def export_csv(self, path: str) -> None:
+        """Write one row per frame: frame number, frame time and phase times in ms."""
+        frame_times, phase_times = self.ordered(self.frame_times), self.ordered(self.phase_times)
+        first = self.frames - len(self)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("frame", "frame_ms") + tuple(f"{phase}_ms" for phase in PHASES))
+            for n in range(len(self)):
+                writer.writerow([first + n, f"{frame_times[n] * 1000:.3f}"] + [f"{t * 1000:.3f}" for t in phase_times[n]])
+
+    def export(self, path: str) -> None:
+        """Chrome trace for a .json path, CSV otherwise."""
+        if path.endswith(".json"):
+            self.export_chrome_trace(path)
+        else:
+            self.export_csv(path)
+
+
+class ProfilerOverlay():
+    """Frame time percentiles drawn over the screen, refreshed a few times per second.
+
+    With a tick_profiler of its own (simulation thread), the ticks are shown below the frames.
+    """
+    def __init__(self, profiler: FrameProfiler, tick_profiler: FrameProfiler = None, refresh: int = 30) -> None:
+        self.profiler: FrameProfiler = profiler
+        self.tick_profiler = tick_profiler if tick_profiler is not profiler else None
+        self.refresh: int = refresh
+        self.font = pygame.font.Font(None, 20)
+        self.surface = None
+        self.last_refresh: int = -refresh
+
+    def lines(self, profiler: FrameProfiler, name: str) -> list:
+        summary = profiler.summary()
+        if not summary:
+            return [f"{name}: collecting..."]
+        lines = [f"{name} p50 {summary['p50']:.2f}  p95 {summary['p95']:.2f}  p99 {summary['p99']:.2f}  max {summary['max']:.2f} ms"]
+        return lines + [f"{phase:>10} {ms:6.2f} ms" for phase, ms in summary["phases"].items()]
+
+    def render(self) -> pygame.Surface:
+        lines = self.lines(self.profiler, "frame")
+        if self.tick_profiler is not None:
+            lines += self.lines(self.tick_profiler, "tick")
+        texts = [self.font.render(line, True, (255, 255, 0)) for line in lines]
+        line_h = self.font.get_linesize()
+        surface = pygame.Surface((max(text.get_width() for text in texts) + 8, line_h * len(texts) + 8))
+        surface.fill((0, 0, 0))
+        for i, text in enumerate(texts):
+            surface.blit(text, (4, 4 + i * line_h))
+        return surface
+
+    def draw(self, surface) -> pygame.Rect:
+        """Draw the overlay at the bottom left of surface and return its rect."""
+        if self.surface is None or self.profiler.frames - self.last_refresh >= self.refresh:
+            self.surface = self.render()
+            self.last_refresh = self.profiler.frames
+        return surface.blit(self.surface, self.surface.get_rect(bottomleft=(0, surface.get_height())))
@@ -0,0 +1,226 @@
+import atexit
+import collections
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import warnings
+
+
+class RankingStore():
+    """Ranking stored in SQLite.
+
+    Every score is appended to 'scores' and the best score of each player is kept
+    in 'best', indexed on the score. Each insert is one atomic transaction costing
+    O(log n), and the top N is read in O(N) by walking the index.
+    """
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.connection = sqlite3.connect(path)
+        # Write-ahead log: a crash never leaves a half-written ranking
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS scores (id INTEGER PRIMARY KEY, name TEXT NOT NULL, score INTEGER NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS best (name TEXT PRIMARY KEY, score INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS best_score ON best (score)")
+            # Files already imported by migrate_json
+            self.connection.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+
+    def add(self, name: str, score: int) -> None:
+        self.add_many([(name, score)])
+
+    def add_many(self, data: list, best: list = None) -> None:
+        """Add a list of (name, score) in a single transaction.
+
+        'best' is data merged to one (name, best score) per player, if known.
+        """
+        with self.connection:
+            self.insert(data, best)
+
+    def insert(self, data: list, best: list = None) -> None:
+        """Insert (name, score) in the current transaction."""
+        self.connection.executemany("INSERT INTO scores (name, score) VALUES (?, ?)", data)
+        self.connection.executemany(
+            "INSERT INTO best (name, score) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET score = excluded.score WHERE excluded.score > best.score",
+            data if best is None else best)
+
+    def top(self, n: int) -> list:
+        """Return the n best (name, score), best first."""
+        return self.connection.execute("SELECT name, score FROM best ORDER BY score DESC LIMIT ?", (n,)).fetchall()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def migrate_json(self, filename: str) -> int:
+        """Import the former JSON ranking {name: score} once, then rename the file.
+
+        The scores and the migration mark are written in the same transaction: a
+        file left in place by a crash before the rename is not imported again.
+        Returns the number of imported scores.
+        """
+        if not os.path.exists(filename):
+            return 0
+        name = os.path.basename(filename)
+        if self.connection.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+            os.replace(filename, filename + ".migrated")
+            return 0
+        try:
+            with open(filename, "r") as file:
+                ranking = json.load(file)
+            data = [(str(name), int(score)) for name, score in ranking.items()]
+        except (OSError, ValueError, AttributeError) as error:
+            warnings.warn(f"Cannot migrate the ranking {filename}: {error}")
+            return 0
+        with self.connection:
+            self.insert(data)
+            self.connection.execute("INSERT INTO migrations (name) VALUES (?)", (name,))
+        os.replace(filename, filename + ".migrated")
+        return len(data)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+# Asks the writer thread to stop
+STOP = object()
+
+
+class ScoreWriter():
+    """Write the scores to a RankingStore on a background thread.
+
+    submit() never blocks the caller: the scores go through a bounded queue, and
+    when it is full they are kept in an overflow list picked up at the next write.
+    The writer drains everything queued at once and writes it in a single
+    transaction: every game goes in the history, the repeated saves of a player
+    are merged for the best scores only.
+    The store is opened, and the JSON ranking 'migrate' imported, on the thread.
+    An error never stops the thread, and flush() or close() never wait on a dead one.
+    Pending scores are flushed on close() and at interpreter exit.
+    """
+    def __init__(self, path: str, max_queue: int = 64, migrate: str = None) -> None:
+        self.path: str = path
+        self.migrate = migrate
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.overflow: list = []
+        self.lock = threading.Lock()
+        # Set once the store is opened, or failed to
+        self.ready = threading.Event()
+        # Metrics
+        self.writes: int = 0
+        self.merged: int = 0
+        self.errors: int = 0
+        self.last_error = None
+        self.latencies: collections.deque = collections.deque(maxlen=256)
+        self.max_depth: int = 0
+
+        self.closed: bool = False
+        self.thread = threading.Thread(target=self.run, name="score-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, name: str, score: int) -> None:
+        try:
+            self.queue.put_nowait((name, score))
+        except queue.Full:
+            with self.lock:
+                self.overflow.append((name, score))
+            self.wake()
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def wake(self) -> None:
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def fail(self, error: Exception) -> None:
+        self.errors += 1
+        self.last_error = error
+
+    def open_store(self):
+        """The RankingStore, None if it cannot be opened."""
+        try:
+            store = RankingStore(self.path)
+            if self.migrate is not None:
+                store.migrate_json(self.migrate)
+            return store
+        except Exception as error:
+            warnings.warn(f"Cannot open the ranking {self.path}: {error}")
+            self.fail(error)
+            return None
+        finally:
+            self.ready.set()
+
+    def run(self) -> None:
+        store = self.open_store()
+        stop: bool = False
+        while not stop:
+            items = [self.queue.get()]
+            try:
+                # Everything queued meanwhile goes in the same transaction
+                while True:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                with self.lock:
+                    games, self.overflow = self.overflow, []
+                stop = STOP in items
+                games += [item for item in items if item is not None and item is not STOP]
+                if games and store is not None:
+                    best: dict = {}
+                    for name, score in games:
+                        best[name] = max(score, best.get(name, score))
+                    start = time.perf_counter()
+                    store.add_many(games, list(best.items()))
+                    self.writes += 1
+                    self.merged += len(games) - len(best)
+                    self.latencies.append(time.perf_counter() - start)
+            except Exception as error:
+                self.fail(error)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+        if store is not None:
+            store.close()
+
+    def flush(self) -> None:
+        """Block until every submitted score is written, or the writer is dead."""
+        self.ready.wait()
+        with self.lock:
+            overflow = bool(self.overflow)
+        if overflow:
+            self.wake()
+        waiter = self.queue.all_tasks_done
+        with waiter:
+            while self.queue.unfinished_tasks and self.thread.is_alive():
+                waiter.wait(0.1)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.queue.put(STOP, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+
+    def metrics(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "overflow": len(self.overflow),
+            "writes": self.writes,
+            "merged": self.merged,
+            "errors": self.errors,
+            "last_latency_ms": self.latencies[-1] * 1000 if latencies else 0.,
+            "max_latency_ms": latencies[-1] * 1000 if latencies else 0.,
+            "median_latency_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.,
+        }
@@ -0,0 +1,121 @@
+import struct
+import time
+import zlib
+import pygame
+
+
+# Log layout: header | zlib(one byte per tick) | footer
+MAGIC: bytes = b"SIRP"
+VERSION: int = 2
+HEADER = struct.Struct("<4sBQ")   # magic, version, seed
+FOOTER = struct.Struct("<IiiI")   # ticks, score, lives, aliens remaining
+
+# Bits of a tick
+KEY_BITS: dict = {pygame.K_LEFT: 1, pygame.K_RIGHT: 2, pygame.K_SPACE: 4}
+
+
+class KeyState():
+    """Replayed keyboard, indexed like pygame.key.get_pressed()."""
+    def __init__(self, bits: int = 0) -> None:
+        self.bits: int = bits
+
+    def __getitem__(self, key: int) -> bool:
+        return bool(self.bits & KEY_BITS.get(key, 0))
+
+
+def world_state(world) -> tuple:
+    """The final state checked by a replay: score, lives and aliens remaining."""
+    return (world.game.score, world.player.sprite.lives, len(world.aliens_wave.group))
+
+
+class Recorder():
+    """Record the inputs of a GameWorld, one byte per tick.
+
+    The timers of the world run on the simulation ticks, so only the keys are recorded.
+    Without path, nothing is written: it only keeps the final state (used by the replay).
+    """
+    def __init__(self, path: str, seed: int) -> None:
+        self.path: str = path
+        self.seed: int = seed
+        self.ticks: bytearray = bytearray()
+        self.recording: bool = True
+        self.world = None
+        self.final = None
+
+    def record(self, keys, world) -> None:
+        # Only the first world is recorded, the log has a single seed
+        if not self.recording or self.world not in (None, world):
+            return
+        self.world = world
+        bits: int = 0
+        for key, bit in KEY_BITS.items():
+            if keys[key]:
+                bits |= bit
+        self.ticks.append(bits)
+
+    def stop(self, world=None) -> None:
+        """Write the log with the final state of the world (the last recorded one by default)."""
+        world = world if world is not None else self.world
+        if not self.recording or world is None:
+            return
+        self.recording = False
+        self.final = world_state(world)
+        if self.path is None:
+            return
+        with open(self.path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, self.seed))
+            file.write(zlib.compress(bytes(self.ticks), 9))
+            file.write(FOOTER.pack(len(self.ticks), *self.final))
+
+
+def load(path: str) -> tuple:
+    """Return (seed, ticks, final state) of a log."""
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, seed = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a replay log (version {VERSION})")
+    n_ticks, *final = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+    ticks = zlib.decompress(data[HEADER.size:len(data) - FOOTER.size])
+    if len(ticks) != n_ticks:
+        raise ValueError(f"{path} is truncated")
+    return seed, ticks, tuple(final)
+
+
+def replay(path: str) -> dict:
+    """Replay a log headlessly, as fast as possible, and check the final state."""
+    from game import Game
+    from states import GameWorld
+
+    seed, ticks, expected = load(path)
+    game = Game(headless=True, seed=seed)
+    game.recorder = Recorder(None, seed)
+    world = GameWorld(game)
+    world.enter_state()
+    keys = KeyState()
+    game.input_keys = keys
+
+    start = time.perf_counter()
+    for bits in ticks:
+        keys.bits = bits
+        game.events = []
+        game.update()
+    elapsed = time.perf_counter() - start
+    # A game left before its end has no transition
+    game.recorder.stop(world)
+    final = game.recorder.final
+    return {
+        "ticks": len(ticks),
+        "expected": expected,
+        "final": final,
+        "match": final == expected and game.recorder.ticks == ticks,
+        "ticks_per_s": len(ticks) / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    result = replay(sys.argv[1])
+    print(f"Replayed {result['ticks']} ticks at {result['ticks_per_s']:.0f} ticks/s: "
+          f"{'OK' if result['match'] else 'MISMATCH'} (expected {result['expected']}, got {result['final']})")
+    sys.exit(0 if result["match"] else 1)
@@ -0,0 +1,68 @@
+import heapq
+import itertools
+
+from settings import TICK_RATE
+
+
+def ms_to_ticks(ms: int) -> int:
+    return max(1, round(ms * TICK_RATE / 1000))
+
+
+class Timer():
+    """A callback scheduled on a tick, repeated every 'interval' ticks if set."""
+    __slots__ = ("tick", "interval", "callback", "cancelled")
+
+    def __init__(self, tick: int, interval, callback) -> None:
+        self.tick: int = tick
+        self.interval = interval
+        self.callback = callback
+        self.cancelled: bool = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Scheduler():
+    """Run callbacks on the simulation ticks instead of the wall clock.
+
+    The timers are kept in a binary heap ordered by (tick, insertion order), so
+    scheduling and firing cost O(log n). advance() is called once per update: the
+    timers follow the simulation, whether it is paused, fast-forwarded or headless.
+    Cancelled timers are dropped lazily when they reach the top of the heap.
+    """
+    def __init__(self) -> None:
+        self.tick: int = 0
+        self.heap: list = []
+        self.counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, timer: Timer) -> Timer:
+        heapq.heappush(self.heap, (timer.tick, next(self.counter), timer))
+        return timer
+
+    def call_later(self, ticks: int, callback) -> Timer:
+        """Call callback() in 'ticks' ticks (at least one)."""
+        return self.push(Timer(self.tick + max(1, ticks), None, callback))
+
+    def call_every(self, ticks: int, callback) -> Timer:
+        """Call callback() every 'ticks' ticks, starting in 'ticks' ticks."""
+        ticks = max(1, ticks)
+        return self.push(Timer(self.tick + ticks, ticks, callback))
+
+    def advance(self) -> None:
+        """Move to the next tick and fire the timers due."""
+        self.tick += 1
+        heap = self.heap
+        while heap and heap[0][0] <= self.tick:
+            timer = heapq.heappop(heap)[2]
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:
+                timer.tick += timer.interval
+                self.push(timer)
+            timer.callback()
+
+    def clear(self) -> None:
+        self.heap.clear()
@@ -5,11 +5,23 @@ SCREEN_W: int = 960
 SCREEN_H: int = 720
 BACKGROUND_COLOR: tuple = (30, 30, 30)
 
+# Rendering
+DIRTY_RENDERING: bool = False # Only scale and push the changed regions of the canvas
+MAX_DIRTY_RECTS: int = 64
+PROFILER_FRAMES: int = 600 # Frames kept by the profiler (F3)
+
 # Font
 FONTSIZE: int = 15
+TEXT_CACHE_SIZE: int = 256 # Rendered text surfaces kept in memory
+
+# Assets
+ASSET_CACHE_SIZE: int = None # None to never evict
 
 # Framerate
-FRAMERATE: int = 60
+FRAMERATE: int = 60 # Rendering cap, the simulation runs at TICK_RATE
+TICK_RATE: int = 60 # Simulation ticks per second
+MAX_TICKS_PER_FRAME: int = 5
+THREADED_SIMULATION: bool = False # Simulation on its own thread (--threaded)
 
 # Motion
 SPACECRAFT_SPEED: int = 5
@@ -19,11 +31,25 @@ EXTRA_SPEED:int = 2
 LASER_SPEED: int = 5
 ALIEN_LASER_SPEED: int = 3
 
+# Aliens wave
+VECTORIZED_WAVE: bool = True # NumPy structure-of-arrays wave
+
+# Audio
+MIXER_CHANNELS: int = 8 # Voices mixed at once
+
 # Laser
 LASER_COOLDOWN: int = 600
+LASER_POOL_SIZE: int = 32 # Lasers alive at once, per shooter
 
 # Health
 LIVES: int = 3
 
+# Spectators
+SPECTATOR_HOST: str = "127.0.0.1" # Local viewers only
+SPECTATOR_PORT: int = 8765
+SPECTATOR_KEYFRAME_INTERVAL: int = 120 # Ticks between two full states
+SPECTATOR_MAX_BACKLOG: int = 64 * 1024 # Bytes unsent to a viewer before it skips to the next keyframe
+
 # Save
-SAVE_FILE: str = "save.json"
\ No newline at end of file
+SAVE_FILE: str = "save.json" # Former ranking, migrated to RANKING_DB
+RANKING_DB: str = "save.db"
\ No newline at end of file
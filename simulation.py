@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+
+from profiler import FrameProfiler
+from settings import MAX_TICKS_PER_FRAME
+
+
+class WorldSnapshot():
+    """What the renderer needs of a GameWorld at one tick, never modified after creation.
+
+    'aliens' and 'sprites' are columns (images, x, y, prev_x, prev_y) and the
+    bunkers are (image copy, topleft) pairs.
+    """
+    __slots__ = ("bunkers", "aliens", "sprites", "score", "lives")
+
+    def __init__(self, bunkers: list, aliens: tuple, sprites: tuple, score: int, lives: int) -> None:
+        self.bunkers: list = bunkers
+        self.aliens: tuple = aliens
+        self.sprites: tuple = sprites
+        self.score: int = score
+        self.lives: int = lives
+
+
+class Snapshot():
+    """The active state at a tick, with its world snapshot (None for the menus)."""
+    __slots__ = ("state", "world", "time")
+
+    def __init__(self, state, world, tick_time: float) -> None:
+        self.state = state
+        self.world = world
+        self.time: float = tick_time
+
+
+class TripleBuffer():
+    """Hand the latest snapshot from the simulation thread to the render thread.
+
+    The writer fills its back slot then swaps it with the middle one; the reader
+    swaps the middle slot with its front one when a newer snapshot is there. No
+    side ever waits for the work of the other, only for an index swap.
+    """
+    def __init__(self) -> None:
+        self.slots: list = [None, None, None]
+        self.back, self.middle, self.front = 0, 1, 2
+        self.fresh: bool = False
+        self.lock = threading.Lock()
+
+    def publish(self, item) -> None:
+        self.slots[self.back] = item
+        with self.lock:
+            self.back, self.middle = self.middle, self.back
+            self.fresh = True
+
+    def latest(self):
+        """The newest published item, None before the first one."""
+        with self.lock:
+            if self.fresh:
+                self.front, self.middle = self.middle, self.front
+                self.fresh = False
+        return self.slots[self.front]
+
+
+class SimulationThread():
+    """Run Game.update on its own thread at the fixed tick rate.
+
+    The main thread keeps polling the events (SDL needs it) and sends them with
+    the keyboard state; after every batch of ticks the simulation publishes a
+    Snapshot in a TripleBuffer, which the main thread renders at its own pace.
+    Only the GameWorld has a snapshot: the menus and the overlays are drawn from
+    the live states, so every tick holds 'lock' and the main thread takes it to
+    draw them.
+    The ticks are profiled by the thread's own FrameProfiler, one frame per tick,
+    while it runs it is the game tick_profiler.
+    """
+    def __init__(self, game) -> None:
+        self.game = game
+        self.buffer: TripleBuffer = TripleBuffer()
+        # Held while the states change, see above
+        self.lock = threading.Lock()
+        self.profiler: FrameProfiler = FrameProfiler(game.profiler.capacity)
+        self.inbox: queue.SimpleQueue = queue.SimpleQueue()
+        self.running: bool = False
+        self.ticks: int = 0
+        self.dropped_ticks: int = 0
+        self.thread = None
+
+    def start(self) -> None:
+        self.profiler.enabled = self.game.profiler.enabled
+        self.game.tick_profiler = self.profiler
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="simulation", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.game.tick_profiler = self.game.profiler
+
+    def send(self, events: list, keys) -> None:
+        """Inputs of a frame, applied at the next tick."""
+        self.inbox.put((events, keys))
+
+    def run(self) -> None:
+        game = self.game
+        dt = game.dt
+        profiler = self.profiler
+        profiler.begin_frame()
+        pending: list = []
+        next_tick = time.perf_counter()
+        self.publish(next_tick)
+        while self.running and game.playing:
+            while True:
+                try:
+                    events, keys = self.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                pending += events
+                game.input_keys = keys
+            now = time.perf_counter()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                continue
+            ticks: int = 0
+            while now >= next_tick and ticks < MAX_TICKS_PER_FRAME:
+                game.events, pending = pending, []
+                with self.lock:
+                    profiler.start("update")
+                    game.update()
+                    profiler.stop("update")
+                profiler.end_frame()
+                next_tick += dt
+                ticks += 1
+            self.ticks += ticks
+            # Too slow to catch up: drop the late ticks instead of spiralling
+            if now >= next_tick:
+                self.dropped_ticks += int((now - next_tick) / dt) + 1
+                next_tick = now + dt
+            self.publish(next_tick - dt)
+        game.input_keys = None
+
+    def publish(self, tick_time: float) -> None:
+        state = self.game.state_stack[-1]
+        self.buffer.publish(Snapshot(state, state.snapshot(), tick_time))
+
+    def latest(self):
+        return self.buffer.latest()
+
+    def alpha(self, snapshot: Snapshot) -> float:
+        """Progress from the last tick of the snapshot toward the next one, in [0, 1]."""
+        return min(1., max(0., (time.perf_counter() - snapshot.time) / self.game.dt))
@@ -0,0 +1,262 @@
+import asyncio
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+from settings import *
+
+
+# Stream: MAGIC, then messages (kind, tick, payload size) + payload
+MAGIC: bytes = b"SPIV\x01"
+MESSAGE = struct.Struct("<BII")
+KEYFRAME, DELTA = 1, 2
+# Score, lives, player x, extra x, number of aliens, laser slots and bunkers
+HEADER = struct.Struct("<iBhhHHH")
+BUNKER = struct.Struct("<hhHH")
+# Position of a missing extra or of a free laser slot
+NONE: int = -32768
+
+
+def encode_world(world) -> bytes:
+    """The state of a GameWorld in a fixed layout.
+
+    Every alien created and every laser of the pools keeps its place in the
+    layout, so from one tick to the next only the moved or killed ones change
+    bytes and the XOR of two states is mostly zeros.
+    """
+    alive, x, y, values = world.aliens_wave.grid()
+    slots = world.player.sprite.laser_pool.lasers + world.aliens_wave.laser_pool.lasers
+    lasers = np.full((len(slots), 2), NONE, dtype=np.int16)
+    for i, laser in enumerate(slots):
+        if laser.alive():
+            lasers[i] = laser.rect.topleft
+    bunkers = world.obstacles.sprites()
+    extra = world.extra.sprite
+    player = world.player.sprite
+    parts = [HEADER.pack(world.game.score, max(0, player.lives), player.rect.x, extra.rect.x if extra else NONE,
+                         len(alive), len(slots), len(bunkers)),
+             np.packbits(np.asarray(alive, dtype=bool)).tobytes(),
+             np.asarray(x, dtype=np.int16).tobytes(), np.asarray(y, dtype=np.int16).tobytes(),
+             np.asarray(values, dtype=np.uint16).tobytes(), lasers.tobytes()]
+    for bunker in bunkers:
+        parts.append(BUNKER.pack(bunker.rect.x, bunker.rect.y, bunker.cols, bunker.rows))
+    parts.append(np.packbits(np.frombuffer(b"".join(bunker.cells for bunker in bunkers), dtype=bool)).tobytes())
+    return b"".join(parts)
+
+
+def decode_world(state: bytes) -> dict:
+    """Read back a state of encode_world: NumPy arrays and the bunkers as (x, y, cells grid)."""
+    score, lives, player_x, extra_x, n_aliens, n_slots, n_bunkers = HEADER.unpack_from(state)
+    offset = HEADER.size
+    alive = np.unpackbits(np.frombuffer(state, np.uint8, (n_aliens + 7) // 8, offset), count=n_aliens).astype(bool)
+    offset += (n_aliens + 7) // 8
+    x, y, values = (np.frombuffer(state, dtype, n_aliens, offset + i * 2 * n_aliens)
+                    for i, dtype in enumerate((np.int16, np.int16, np.uint16)))
+    offset += 6 * n_aliens
+    lasers = np.frombuffer(state, np.int16, 2 * n_slots, offset).reshape(n_slots, 2)
+    offset += 4 * n_slots
+    lasers = lasers[lasers[:, 0] != NONE]
+    shapes = [BUNKER.unpack_from(state, offset + i * BUNKER.size) for i in range(n_bunkers)]
+    offset += n_bunkers * BUNKER.size
+    cells = np.unpackbits(np.frombuffer(state, np.uint8, offset=offset))
+    bunkers = []
+    for bunker_x, bunker_y, cols, rows in shapes:
+        bunkers.append((bunker_x, bunker_y, cells[:rows * cols].reshape(rows, cols)))
+        cells = cells[rows * cols:]
+    return {"score": score, "lives": lives, "player_x": player_x, "extra_x": None if extra_x == NONE else extra_x,
+            "alive": alive, "x": x, "y": y, "values": values, "lasers": lasers, "bunkers": bunkers}
+
+
+def xor(a: bytes, b: bytes) -> bytes:
+    return np.bitwise_xor(np.frombuffer(a, np.uint8), np.frombuffer(b, np.uint8)).tobytes()
+
+
+class Viewer(asyncio.Protocol):
+    """A connected spectator, only written to."""
+    def __init__(self, server) -> None:
+        self.server = server
+        self.transport = None
+        # A viewer starts, and restarts after falling behind, on a keyframe
+        self.needs_keyframe: bool = True
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        transport.write(MAGIC)
+        self.server.viewers.add(self)
+
+    def connection_lost(self, exc) -> None:
+        self.server.viewers.discard(self)
+        if not self.server.viewers:
+            self.server.state = None
+
+
+class SpectatorServer():
+    """Stream the GameWorld to local viewers over TCP.
+
+    The asyncio loop runs on its own thread. After each tick, publish() encodes
+    the world (cheap, on the simulation thread) and hands it to the loop, which
+    sends either a keyframe (the zlib compressed state) or a delta (the zlib
+    compressed XOR with the previous state). Each message is built once and the
+    same bytes are written to every viewer, so a tick costs one compression
+    whatever the number of viewers.
+    A viewer whose unsent data exceed max_backlog misses the next messages and
+    resumes on a fresh keyframe once it has caught up; it never slows the game.
+    Nothing is encoded while there is no viewer.
+    """
+    def __init__(self, host: str = SPECTATOR_HOST, port: int = SPECTATOR_PORT,
+                 keyframe_interval: int = SPECTATOR_KEYFRAME_INTERVAL, max_backlog: int = SPECTATOR_MAX_BACKLOG) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.keyframe_interval: int = keyframe_interval
+        self.max_backlog: int = max_backlog
+        self.viewers: set = set()
+        self.tick: int = 0
+        # Last state sent and tick of the last keyframe
+        self.state = None
+        self.keyframe_tick: int = 0
+        self.stats: dict = {"keyframes": 0, "deltas": 0, "bytes": 0, "raw_bytes": 0, "skipped": 0, "peak_viewers": 0}
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self) -> None:
+        """Listen on a thread, return once the port is open (port 0 picks a free one)."""
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(ready,), name="spectators", daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def run(self, ready: threading.Event) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(self.loop.create_server(lambda: Viewer(self), self.host, self.port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+        self.server.close()
+        for viewer in list(self.viewers):
+            viewer.transport.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def stop(self) -> None:
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+
+    def publish(self, world) -> None:
+        """Send the state of the world after a tick, from the simulation thread."""
+        self.tick += 1
+        if self.viewers:
+            self.loop.call_soon_threadsafe(self.broadcast, self.tick, encode_world(world))
+
+    def broadcast(self, tick: int, state: bytes) -> None:
+        previous, self.state = self.state, state
+        messages: dict = {}
+
+        def message(kind: int) -> bytes:
+            if kind not in messages:
+                payload = zlib.compress(state if kind == KEYFRAME else xor(state, previous), 1)
+                messages[kind] = MESSAGE.pack(kind, tick, len(payload)) + payload
+                self.stats["keyframes" if kind == KEYFRAME else "deltas"] += 1
+            return messages[kind]
+
+        # A new layout (a new wave) cannot be XORed with the previous one
+        if previous is None or len(previous) != len(state) or tick - self.keyframe_tick >= self.keyframe_interval:
+            self.keyframe_tick = tick
+            for viewer in self.viewers:
+                viewer.needs_keyframe = True
+        for viewer in self.viewers:
+            if viewer.transport.get_write_buffer_size() > self.max_backlog:
+                viewer.needs_keyframe = True
+                self.stats["skipped"] += 1
+                continue
+            data = message(KEYFRAME if viewer.needs_keyframe else DELTA)
+            viewer.needs_keyframe = False
+            viewer.transport.write(data)
+            self.stats["bytes"] += len(data)
+        self.stats["raw_bytes"] += len(state) * len(self.viewers)
+        self.stats["peak_viewers"] = max(self.stats["peak_viewers"], len(self.viewers))
+
+
+class SpectatorClient():
+    """Rebuild the streamed state, without display.
+
+    'state' is the last encoded state received and view() decodes it.
+    """
+    def __init__(self) -> None:
+        self.state = None
+        self.tick: int = 0
+        self.messages: int = 0
+        self.keyframes: int = 0
+        self.bytes: int = 0
+
+    def apply(self, kind: int, tick: int, payload: bytes) -> None:
+        data = zlib.decompress(payload)
+        if kind == KEYFRAME:
+            self.state = data
+            self.keyframes += 1
+        elif self.state is not None:
+            self.state = xor(self.state, data)
+        self.tick = tick
+        self.messages += 1
+
+    def view(self) -> dict:
+        return decode_world(self.state) if self.state is not None else None
+
+    async def run(self, host: str = SPECTATOR_HOST, port: int = SPECTATOR_PORT, ticks: int = None, on_tick=None) -> None:
+        """Receive until the server closes or 'ticks' messages were applied, on_tick(self) after each one."""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            if await reader.readexactly(len(MAGIC)) != MAGIC:
+                raise ValueError("Not a spectator stream")
+            while ticks is None or self.messages < ticks:
+                try:
+                    kind, tick, size = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+                    payload = await reader.readexactly(size)
+                except asyncio.IncompleteReadError:
+                    break
+                self.bytes += MESSAGE.size + size
+                self.apply(kind, tick, payload)
+                if on_tick is not None:
+                    on_tick(self)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+async def watch(host: str, port: int, viewers: int, ticks: int = None) -> list:
+    """Run 'viewers' clients at once, print the state seen by the first one every second."""
+    clients = [SpectatorClient() for _ in range(viewers)]
+    last = [time.perf_counter(), 0]
+
+    def report(client: SpectatorClient) -> None:
+        now = time.perf_counter()
+        if now - last[0] >= 1.:
+            view = client.view()
+            if view is not None:
+                rate = (client.bytes - last[1]) / (now - last[0]) / 1000
+                print(f"tick {client.tick}: score {view['score']}, lives {view['lives']}, "
+                      f"{int(view['alive'].sum())} aliens, {len(view['lasers'])} lasers, {rate:.1f} kB/s per viewer")
+            last[:] = now, client.bytes
+
+    await asyncio.gather(*(client.run(host, port, ticks, report if i == 0 else None) for i, client in enumerate(clients)))
+    return clients
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Watch a game started with --spectate")
+    parser.add_argument("--host", default=SPECTATOR_HOST)
+    parser.add_argument("--port", type=int, default=SPECTATOR_PORT)
+    parser.add_argument("--viewers", type=int, default=1, help="number of viewers to connect, for load tests")
+    parser.add_argument("--ticks", type=int, default=None, help="stop after this number of ticks")
+    args = parser.parse_args()
+    try:
+        clients = asyncio.run(watch(args.host, args.port, args.viewers, args.ticks))
+    except (ConnectionError, KeyboardInterrupt) as error:
+        raise SystemExit(str(error))
+    for i, client in enumerate(clients):
+        print(f"viewer {i}: {client.messages} ticks, {client.keyframes} keyframes, {client.bytes / 1000:.1f} kB")
@@ -1,50 +1,112 @@
 import pygame
+import random
 
-from random import choice
 from settings import * #SPACECRAFT_SPEED, LASER_SPEED, LASER_COOLDOWN, ALIEN_SPEED
+from ui import draw_interpolated
+from scheduler import Scheduler, ms_to_ticks
+from audio import SoundDispatcher
+from collision import SpatialHash
+
 
 class Laser(pygame.sprite.Sprite):
-    """Laser sprite.
+    """Laser sprite, owned by a LaserPool.
     
     State x_t = (x, y)"""
-    def __init__(self, pos, velocity: int, sound: pygame.mixer.Sound) -> None:
+    def __init__(self, pool, image: pygame.Surface) -> None:
         super().__init__()
-        self.image = pygame.Surface((4, 20))
-        self.image.fill('white')
-        self.rect = self.image.get_rect(center=pos)
-        self.velocity: int = velocity
-        sound.play()
+        self.pool = pool
+        self.image = image
+        self.rect = self.image.get_rect()
+        self.velocity: int = 0
+        # Position before the last update, for the interpolation
+        self.prev_pos: tuple = self.rect.topleft
+
+    def fire(self, pos, velocity: int) -> None:
+        self.rect.center = pos
+        self.prev_pos = self.rect.topleft
+        self.velocity = velocity
 
     def update_state(self) -> None:
         """Update the position y of the laser"""
+        self.prev_pos = self.rect.topleft
         self.rect.y += self.velocity
     
     def check_pos(self) -> None:
-        if self.rect.bottom <= 0:
+        # Culled as soon as it leaves the canvas, upward or downward
+        if self.rect.bottom <= 0 or self.rect.top >= GAME_H:
             self.kill()
     
     def update(self, dt) -> None:
         self.update_state()
         self.check_pos()
 
+    def kill(self) -> None:
+        """Remove the laser from its groups and give it back to the pool."""
+        if self.alive():
+            super().kill()
+            self.pool.release(self)
+
+
+class LaserPool():
+    """Fixed number of lasers, reused instead of allocated on every shot.
+    
+    All the lasers share one image. The fired ones are in the 'active' group; a
+    shot is dropped when the pool is exhausted."""
+    def __init__(self, capacity: int = LASER_POOL_SIZE) -> None:
+        self.image = pygame.Surface((4, 20))
+        self.image.fill('white')
+        self.capacity: int = capacity
+        # Every laser of the pool, in a fixed order
+        self.lasers: list = [Laser(self, self.image) for _ in range(capacity)]
+        self.free: list = list(self.lasers)
+        self.active: pygame.sprite.Group = pygame.sprite.Group()
+        self.peak: int = 0
+        self.dropped: int = 0
+
+    @property
+    def live(self) -> int:
+        return len(self.active)
+
+    def fire(self, pos, velocity: int):
+        """Fire a laser from pos, return it or None if the pool is exhausted."""
+        if not self.free:
+            self.dropped += 1
+            return None
+        laser = self.free.pop()
+        laser.fire(pos, velocity)
+        self.active.add(laser)
+        self.peak = max(self.peak, len(self.active))
+        return laser
+
+    def release(self, laser: Laser) -> None:
+        self.free.append(laser)
+
+    def clear(self) -> None:
+        for laser in self.active.sprites():
+            laser.kill()
+
+    def stats(self) -> dict:
+        return {"live": self.live, "peak": self.peak, "capacity": self.capacity, "dropped": self.dropped}
+
 
 class Player(pygame.sprite.Sprite):
     """Player class
     
     State of the player:
     x_t = (rect_x, rect_y, ready)"""
-    def __init__(self, pos, x_range, img_dir: str, laser_sound: pygame.mixer.Sound) -> None:
+    def __init__(self, pos, x_range, image: pygame.Surface, audio: SoundDispatcher, scheduler: Scheduler) -> None:
         super().__init__()
 
-        self.image = pygame.image.load(img_dir + "/player.png").convert_alpha()
+        self.image = image
         self.rect = self.image.get_rect(midbottom=pos)
         self.x_range = x_range
         self.ready: bool = True
-        self.current_cooldown: int = 0
+        self.scheduler: Scheduler = scheduler
         self.lives: int = LIVES
 
-        self.laser_sound = laser_sound
-        self.lasers: pygame.sprite.Group = pygame.sprite.Group()
+        self.audio: SoundDispatcher = audio
+        self.laser_pool: LaserPool = LaserPool()
+        self.lasers: pygame.sprite.Group = self.laser_pool.active
     
     def check_pos(self) -> None:
         if self.rect.left <= self.x_range[0]:
@@ -55,7 +117,7 @@ class Player(pygame.sprite.Sprite):
     def is_alive(self):
         return True if self.lives > 0 else False
     
-    def update_state(self, keys) -> None:
+    def update_state(self, keys, dt: float) -> None:
         # Change the position
         if keys[pygame.K_RIGHT]:
             self.rect.x += SPACECRAFT_SPEED
@@ -66,37 +128,87 @@ class Player(pygame.sprite.Sprite):
         if keys[pygame.K_SPACE] and self.ready:
             self.shoot_laser()
             self.ready = False
-            self.current_cooldown = pygame.time.get_ticks()
-        self.recharge()
+            self.scheduler.call_later(ms_to_ticks(LASER_COOLDOWN), self.recharge)
     
-    def update(self, dt) -> None:
+    def update(self, dt, keys=None) -> None:
         # Get inputs
-        keys = pygame.key.get_pressed()
+        if keys is None:
+            keys = pygame.key.get_pressed()
         # Update state
-        self.update_state(keys)
+        self.update_state(keys, dt)
         # Check pos
         self.check_pos()
         # Update laser
         self.lasers.update(dt)
     
     def recharge(self) -> None:
-        """Update the state variable 'ready'"""
-        if not self.ready:
-            current_time = pygame.time.get_ticks()
-            if current_time - self.current_cooldown > LASER_COOLDOWN:
-                self.ready = True
+        """Called by the scheduler at the end of the cooldown."""
+        self.ready = True
 
     def shoot_laser(self):
-        self.lasers.add(Laser(self.rect.center, -LASER_SPEED, self.laser_sound))
+        if self.laser_pool.fire(self.rect.center, -LASER_SPEED) is not None:
+            self.audio.play("player_laser")
 
 
-class Block(pygame.sprite.Sprite):
-    """Block sprite"""
-    def __init__(self, size, color, x, y) -> None:
+class Bunker(pygame.sprite.Sprite):
+    """A destructible obstacle.
+    
+    Its cells are stored in an occupancy grid (one byte per cell) and drawn on a
+    single cached surface. Only the destroyed cells are erased from the surface."""
+    def __init__(self, shape: list, block_size: int, color, x, y) -> None:
         super().__init__()
-        self.image = pygame.Surface((size, size))
-        self.image.fill(color)
+        self.block_size: int = block_size
+        self.rows: int = len(shape)
+        self.cols: int = max(len(row) for row in shape)
+        self.cells: bytearray = bytearray(self.rows * self.cols)
+        for row_index, row in enumerate(shape):
+            for col_index, col in enumerate(row):
+                if col == "x":
+                    self.cells[row_index * self.cols + col_index] = 1
+
+        # Incremented each time cells are destroyed
+        self.version: int = 0
+        self.image = pygame.Surface((self.cols * block_size, self.rows * block_size), pygame.SRCALPHA)
         self.rect = self.image.get_rect(topleft=(x, y))
+        self.color = color
+        self.redraw()
+
+    def redraw(self) -> None:
+        """Draw every alive cell on the cached surface."""
+        self.image.fill((0, 0, 0, 0))
+        size = self.block_size
+        for index, cell in enumerate(self.cells):
+            if cell:
+                row, col = divmod(index, self.cols)
+                self.image.fill(self.color, (col * size, row * size, size, size))
+
+    def remaining(self) -> int:
+        """Number of alive cells."""
+        return self.cells.count(1)
+
+    def hit(self, rect: pygame.Rect, destroy: bool = True) -> bool:
+        """Check if rect overlaps an alive cell and destroy all the overlapped cells."""
+        overlap = self.rect.clip(rect)
+        if not overlap.width or not overlap.height:
+            return False
+        size = self.block_size
+        col_0 = (overlap.left - self.rect.x) // size
+        col_1 = (overlap.right - 1 - self.rect.x) // size
+        row_0 = (overlap.top - self.rect.y) // size
+        row_1 = (overlap.bottom - 1 - self.rect.y) // size
+        hit: bool = False
+        for row in range(row_0, row_1 + 1):
+            for col in range(col_0, col_1 + 1):
+                index = row * self.cols + col
+                if self.cells[index]:
+                    hit = True
+                    if destroy:
+                        self.cells[index] = 0
+                        self.image.fill((0, 0, 0, 0), (col * size, row * size, size, size))
+        if hit and destroy:
+            self.version += 1
+        return hit
+
 
 class Obstacle():
     """Class to handle Obstacle."""
@@ -113,13 +225,7 @@ class Obstacle():
     
     def create_obstacle(self, group: pygame.sprite.Group, x_start, y_start) -> None:
         """Create an obstacle of shape 'shape' and add the group."""
-        for row_index, row in enumerate(self.shape):
-            for col_index, col in enumerate(row):
-                if col == "x":
-                    x = x_start + col_index * self.block_size
-                    y = y_start + row_index * self.block_size
-                    block = Block(self.block_size, (241, 79, 80), x, y)
-                    group.add(block)
+        group.add(Bunker(self.shape, self.block_size, (241, 79, 80), x_start, y_start))
     
     def create_many_obstacles(self, group: pygame.sprite.Group, x_start: list[int], y_start: list[int]):
         for x, y in zip(x_start, y_start):
@@ -131,16 +237,12 @@ class Alien(pygame.sprite.Sprite):
     
     State x_t = (x, y, alive)
     """
-    def __init__(self, x, y, img_dir: str) -> None:
+    def __init__(self, x, y, image: pygame.Surface, value: int) -> None:
         super().__init__()
 
-        self.image = pygame.image.load(img_dir).convert_alpha()
+        self.image = image
         self.rect = self.image.get_rect(topleft=(x, y))
-
-        self.value: int
-        if "red" in img_dir: self.value = 100
-        elif "green" in img_dir: self.value = 200
-        else: self.value = 300
+        self.value: int = value
     
     def move_down(self, y_offset: int) -> None:
         self.rect.y += y_offset
@@ -151,13 +253,22 @@ class Alien(pygame.sprite.Sprite):
 
 class AliensWave():
     """This class handles a wave of aliens."""
-    def __init__(self, img_dir: str, laser_sound: pygame.mixer.Sound) -> None:
+    def __init__(self, assets, audio: SoundDispatcher, rng: random.Random = None) -> None:
         self.wave_dir: int = 1
-        self.img_dir = img_dir
+        self.assets = assets
+        self.rng: random.Random = rng if rng is not None else random.Random()
         self.group: pygame.sprite.Group = pygame.sprite.Group()
-        self.laser_sound = laser_sound
-        self.lasers: pygame.sprite.Group = pygame.sprite.Group()
-        
+        # Every alien created, killed or not, in creation order
+        self.aliens: list = []
+        self.audio: SoundDispatcher = audio
+        self.laser_pool: LaserPool = LaserPool()
+        self.lasers: pygame.sprite.Group = self.laser_pool.active
+        # Positions and area before the last update, for the interpolation
+        self.prev_positions: dict = {}
+        self.prev_rect = None
+        # Broad-phase of the collisions with the aliens
+        self.hash: SpatialHash = SpatialHash()
+
 
     def create_wave(self, rows: int, cols: int, x_dist: int = 60, y_dist: int = 48, x_start: int = 70, y_start: int = 100) -> None:
         for row_index, row in enumerate(range(rows)):
@@ -166,22 +277,27 @@ class AliensWave():
                 x: int = col_index * x_dist + x_start
                 y: int = row_index * y_dist + y_start
                 # Chose the color
-                if row_index == 0: alien_sprite = Alien(x, y, self.img_dir + "/yellow.png")
-                elif 1 <= row_index <= 2: alien_sprite = Alien(x, y, self.img_dir + "/green.png")
-                else: alien_sprite = Alien(x, y, self.img_dir + "/red.png")
+                if row_index == 0: alien_sprite = Alien(x, y, self.assets.image("yellow.png"), 300)
+                elif 1 <= row_index <= 2: alien_sprite = Alien(x, y, self.assets.image("green.png"), 200)
+                else: alien_sprite = Alien(x, y, self.assets.image("red.png"), 100)
                 # Add the group
                 self.group.add(alien_sprite)
+                self.aliens.append(alien_sprite)
+        self.hash.sync(self.group)
 
     def check_position(self) -> None:
         # Not optimal but there is a small numbers of aliens
+        # The wave moves down only once, whatever the number of aliens on the edge
         all_aliens = self.group.sprites()
         for alien in all_aliens:
             if alien.rect.right >= GAME_W:
                 self.wave_dir = -1
                 self.move_down(ALIEN_MOVE_DOWN_SPEED)
+                break
             if alien.rect.left <= 0:
                 self.wave_dir = 1
                 self.move_down(ALIEN_MOVE_DOWN_SPEED)
+                break
     
     def move_down(self, y_offset) -> None:
         """Move down all the aliens in the wave."""
@@ -196,32 +312,78 @@ class AliensWave():
             condition = condition or alien.rect.top <= GAME_H
         return condition
 
+    def bounding_rect(self):
+        """Return the area covered by the wave, None if it is empty."""
+        all_aliens = self.group.sprites()
+        if not all_aliens:
+            return None
+        return all_aliens[0].rect.unionall([alien.rect for alien in all_aliens[1:]])
+
+    def snapshot(self) -> tuple:
+        """Images, positions and previous positions of the aliens, as columns."""
+        prev = self.prev_positions
+        aliens = self.group.sprites()
+        positions = [alien.rect.topleft for alien in aliens]
+        previous = [prev.get(alien, position) for alien, position in zip(aliens, positions)]
+        return ([alien.image for alien in aliens], [x for x, _ in positions], [y for _, y in positions],
+                [x for x, _ in previous], [y for _, y in previous])
+
     def shoot_laser(self) -> None:
         # Shoot a laser
         if self.group.sprites():
-            random_alien = choice(self.group.sprites())
-            self.lasers.add(Laser(random_alien.rect.center, ALIEN_LASER_SPEED, self.laser_sound))
+            random_alien = self.rng.choice(self.group.sprites())
+            if self.laser_pool.fire(random_alien.rect.center, ALIEN_LASER_SPEED) is not None:
+                self.audio.play("alien_laser")
     
     def clear_wave(self) -> None:
         self.group.empty()
-        self.lasers.empty()
+        self.aliens.clear()
+        self.laser_pool.clear()
+        self.prev_positions = {}
+        self.prev_rect = None
+        self.hash = SpatialHash()
+
+    def collide(self, rect: pygame.Rect) -> list:
+        """The alive aliens overlapping rect."""
+        return [alien for alien in self.hash.query(rect) if rect.colliderect(alien.rect)]
+
+    def collide_many(self, rects: list) -> list:
+        """collide() of each rect."""
+        return [self.collide(rect) for rect in rects]
+
+    def reaching(self, top: int) -> list:
+        """The alive aliens whose bottom is at or below top."""
+        return [alien for alien in self.group if alien.rect.bottom >= top]
+
+    def grid(self) -> tuple:
+        """Alive flags, x, y and values of every alien created, as lists."""
+        aliens = self.aliens
+        return ([alien.alive() for alien in aliens], [alien.rect.x for alien in aliens],
+                [alien.rect.y for alien in aliens], [alien.value for alien in aliens])
 
     def update(self, dt) -> None:
         self.check_position()
         self.group.update(self.wave_dir)
+        self.hash.sync(self.group)
         self.lasers.update(dt)
+
+    def save_positions(self) -> None:
+        """Remember the positions before the update, for the interpolation."""
+        self.prev_positions = {sprite: sprite.rect.topleft for sprite in self.group}
+        self.prev_rect = self.bounding_rect()
     
-    def render(self, surface):
-        self.group.draw(surface)
-        self.lasers.draw(surface)
+    def render(self, surface, alpha: float = 1.) -> list:
+        """Render the wave at alpha between the last two updates, return the lasers rects."""
+        draw_interpolated(surface, self.group, self.prev_positions, alpha)
+        return draw_interpolated(surface, self.lasers, None, alpha)
 
     
 class Extra(pygame.sprite.Sprite):
     """This class handles an extra alien."""
-    def __init__(self, side: str, img_dir: str) -> None:
+    def __init__(self, side: str, image: pygame.Surface) -> None:
         assert side in ["left", "right"]
         super().__init__()
-        self.image = pygame.image.load(img_dir).convert_alpha()
+        self.image = image
         self.value: int = 500
         if side == "left":
             x = - 50
@@ -238,18 +400,22 @@ class Extra(pygame.sprite.Sprite):
 
 if __name__ == "__main__":
     import sys
+    from assets import AssetManager
     pygame.init()
     SCREEN_W = 600
     SCREEN_H = 600
     screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
     clock = pygame.time.Clock()
     font = pygame.font.Font(None, 25)
-    laser_sound = pygame.mixer.Sound("./assets/audio/laser.wav")
-    player_sprite = Player(pygame.math.Vector2(SCREEN_W//2, SCREEN_H), [0, SCREEN_W], "./assets/graphics", laser_sound)
+    assets = AssetManager("./assets")
+    audio = SoundDispatcher(assets)
+    audio.register("player_laser", "laser.wav")
+    scheduler = Scheduler()
+    player_sprite = Player(pygame.math.Vector2(SCREEN_W//2, SCREEN_H), [0, SCREEN_W], assets.image("player.png"), audio, scheduler)
     player = pygame.sprite.GroupSingle(player_sprite)
     obstacles: pygame.sprite.Group = pygame.sprite.Group()
     aliens: pygame.sprite.Group = pygame.sprite.Group()
-    aliens.add(Alien(50, 100, "./assets/graphics/red.png"))
+    aliens.add(Alien(50, 100, assets.image("red.png"), 100))
     obs_calc = Obstacle(5)
     obs_calc.create_many_obstacles(obstacles, [75, 475], [3*SCREEN_H//4]*2)
 
@@ -258,6 +424,7 @@ if __name__ == "__main__":
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
+        scheduler.advance()
         player.update(0)
         aliens.update()
         screen.fill((30, 30, 30))
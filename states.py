@@ -1,7 +1,10 @@
 import pygame
 
-from random import choice, randint
 from sprites import *
+from vector_wave import VectorAliensWave
+from collision import SpatialHash
+from scheduler import Scheduler, ms_to_ticks
+from simulation import WorldSnapshot
 from settings import *
 from ui import *
 
@@ -17,7 +20,19 @@ class State():
 		-update(dt, events): this function iterates over the events in that particular state.
 		-handle_event(dt, event): this function handles a particular event.
 		-render(surface): this function renders the state.
+
+	A state can also implement render_dirty(surface), which only redraws what has
+	changed since its last render and returns the changed rects (None for the whole surface).
+
+	What does not move is drawn once on a cached layer (see cached_layer).
 	"""
+	# Pre-rendered static layer and the content it was built from
+	layer = None
+	layer_key = None
+	# An overlay is drawn over a frozen picture of the state below it
+	overlay = False
+	backdrop = None
+
 	def __init__(self, game):
 		self.game = game
 		self.prev_state = None
@@ -28,18 +43,52 @@ class State():
 
 	def render(self, surface):
 		pass
+
+	def render_dirty(self, surface):
+		self.render(surface)
+		return None
+
+	def snapshot(self):
+		"""Data to render the state from another thread, None to render the state itself."""
+		return None
 	
 	def handle_event(self, dt, event):
 		if event.type == pygame.QUIT:
 			self.game.running, self.game.playing = False, False
 
+	def cached_layer(self, surface, key, build) -> pygame.Surface:
+		"""Return the static layer, rebuilt with build(layer) only when key changes."""
+		if self.layer is None or key != self.layer_key or self.layer.get_size() != surface.get_size():
+			self.layer = pygame.Surface(surface.get_size())
+			build(self.layer)
+			self.layer_key = key
+		return self.layer
+
 	def enter_state(self):
 		if len(self.game.state_stack) >= 1:
 			self.prev_state = self.game.state_stack[-1]
 		self.game.state_stack.append(self)
+		if self.overlay:
+			# Nothing is drawn headless, and the render thread draws it with a simulation
+			# thread: the backdrop is then captured on demand
+			on_demand = self.game.headless or self.game.simulation is not None
+			self.backdrop = None if on_demand else self.capture_backdrop()
     
 	def exit_state(self):
 		self.game.state_stack.pop()
+		self.backdrop = None
+
+	def capture_backdrop(self) -> pygame.Surface:
+		"""Render the state below once, it does not change while the overlay is shown."""
+		backdrop = pygame.Surface((GAME_W, GAME_H))
+		backdrop.fill(BACKGROUND_COLOR)
+		self.prev_state.render(backdrop)
+		return backdrop
+
+	def get_backdrop(self) -> pygame.Surface:
+		if self.backdrop is None:
+			self.backdrop = self.capture_backdrop()
+		return self.backdrop
 
 
 class MainMenu(State):
@@ -61,7 +110,7 @@ class MainMenu(State):
 	def __init__(self, game):
 		self.game = game
 		# Background
-		self.background = pygame.image.load(self.game.graphics_dir + "/tv.png").convert_alpha()
+		self.background = self.game.assets.image("tv.png")
 		# Menu
 		self.menu = TextMenu({0: "Play", 1: "Ranking", 2: "Credits"}, [GAME_H//2, GAME_H], [0, GAME_W], self.game.font)
 
@@ -100,11 +149,19 @@ class MainMenu(State):
 		surface.fill(BACKGROUND_COLOR)
 		surface.blit(self.background, (0, 0))
 	
-	def render(self, surface):
+	def render_layer(self, surface) -> None:
 		self.render_background(surface)
 		# Menu
 		draw_text(surface, self.game.font, "Space Invaders", (255, 255, 255), GAME_W//2, GAME_H//4)
-		self.menu.render(surface)
+		self.menu.render_options(surface)
+
+	def render(self, surface):
+		surface.blit(self.cached_layer(surface, None, self.render_layer), (0, 0))
+		self.menu.render_cursor(surface)
+
+	def render_dirty(self, surface):
+		self.menu.render_cursor(surface, self.cached_layer(surface, None, self.render_layer))
+		return self.menu.dirty_rects
 
 
 class RankingMenu(State):
@@ -123,6 +180,11 @@ class RankingMenu(State):
 				self.exit_state()
 
 	def render(self, surface):
+		# Rebuilt when another ranking is loaded
+		key = tuple(self.game.sl_manager.ranking.items())
+		surface.blit(self.cached_layer(surface, key, self.render_layer), (0, 0))
+
+	def render_layer(self, surface):
 		self.prev_state.render_background(surface)
 		
 		if bool(self.game.sl_manager.ranking):
@@ -133,6 +195,10 @@ class RankingMenu(State):
 		else:
 			draw_text(surface, self.game.font, "There are no ranking yet !", (255, 255, 255), GAME_W//2, GAME_H//2)
 
+	def render_dirty(self, surface):
+		# Nothing moves
+		return []
+
 
 class CreditsMenu(State):
 	def __init__(self, game):
@@ -149,10 +215,17 @@ class CreditsMenu(State):
 				self.exit_state()
 	
 	def render(self, surface):
+		surface.blit(self.cached_layer(surface, None, self.render_layer), (0, 0))
+
+	def render_layer(self, surface):
 		self.prev_state.render_background(surface)	
 		draw_text(surface, self.game.font, "CREDITS", (255, 255, 255), GAME_W//2, GAME_H//2 - 15)
 		draw_text(surface, self.game.font, "made by Norman Marlier", (255, 255, 255), GAME_W//2, GAME_H//2 + 30)
 
+	def render_dirty(self, surface):
+		# Nothing moves
+		return []
+
 
 class GameWorld(State):
 	"""GameWorld state.
@@ -176,85 +249,140 @@ class GameWorld(State):
 		self.reset()
 
 		# Lives image
-		self.live_surf = pygame.image.load(self.game.graphics_dir + '/player.png').convert_alpha()
+		self.live_surf = self.game.assets.image('player.png')
+
+		# Dirty rendering
+		self.background = None
+		self.drawn_rects: list = []
+		self.bunker_versions: dict = {}
+		# Interpolation
+		self.prev_positions: dict = {}
 	
 	def create_sprites(self):
+		# Timers, on the simulation ticks
+		self.scheduler = Scheduler()
+		# Bunker images copied for the snapshots: {bunker: (version, copy)}
+		self.bunker_copies: dict = {}
+
 		# Obstacles
 		self.obstacles = pygame.sprite.Group()
 		obstacle_calc = Obstacle(5)
 		obstacle_calc.create_many_obstacles(self.obstacles, [75, 225, 375], [3*GAME_H//4]*3)
+		self.obstacles_hash = SpatialHash()
+		self.obstacles_hash.add(self.obstacles)
+		self.obstacles_top: int = min(bunker.rect.top for bunker in self.obstacles)
 		
 		# Player
-		player_sprite = Player(pygame.math.Vector2(GAME_W//2, GAME_H), [0, GAME_W], self.game.graphics_dir, self.laser_sound)
+		player_sprite = Player(pygame.math.Vector2(GAME_W//2, GAME_H), [0, GAME_W], self.game.assets.image("player.png"), self.game.audio, self.scheduler)
 		self.player = pygame.sprite.GroupSingle(player_sprite)
 
 		# Aliens
-		self.aliens_wave = AliensWave(self.game.graphics_dir, self.laser_sound)
+		wave_class = VectorAliensWave if VECTORIZED_WAVE else AliensWave
+		self.aliens_wave = wave_class(self.game.assets, self.game.audio, self.game.rng)
 		self.aliens_wave.create_wave(rows=6, cols=8)
-		self.alien_laser_event = pygame.USEREVENT + 1
-		pygame.time.set_timer(self.alien_laser_event , 800)
+		self.scheduler.call_every(ms_to_ticks(800), self.aliens_wave.shoot_laser)
 		self.extra = pygame.sprite.GroupSingle()
-		self.extra_timer_event = pygame.USEREVENT + 2
-		pygame.time.set_timer(self.extra_timer_event , randint(4*1000, 8*1000)) # Between 4 and 8 secondes
+		self.schedule_extra()
+
+	def schedule_extra(self) -> None:
+		# Between 4 and 8 secondes
+		self.scheduler.call_later(ms_to_ticks(self.game.rng.randint(4*1000, 8*1000)), self.spawn_extra)
+
+	def spawn_extra(self) -> None:
+		self.extra.add(Extra(self.game.rng.choice(['right','left']), self.game.assets.image("extra.png")))
+		self.schedule_extra()
 		
 	
-	def check_collisions(self) -> None:
+	def hit_obstacles(self, sprite) -> bool:
+		"""Destroy the obstacle cells overlapped by the sprite."""
+		hit: bool = False
+		for bunker in self.obstacles_hash.query(sprite.rect):
+			if bunker.hit(sprite.rect):
+				hit = True
+				# A destroyed bunker is still drawn (empty) but never tested again
+				if not bunker.remaining():
+					self.obstacles_hash.remove(bunker)
+		return hit
 
+	def check_collisions(self) -> None:
 		# Possible collisions with laser
 		if self.player.sprite.lasers:
+			# The lasers inside the area of the wave are tested against its aliens at once
+			wave_rect = self.aliens_wave.bounding_rect()
+			lasers = [laser for laser in self.player.sprite.lasers if wave_rect and wave_rect.colliderect(laser.rect)]
+			candidates = dict(zip(lasers, self.aliens_wave.collide_many([laser.rect for laser in lasers])))
 			for laser in self.player.sprite.lasers:
 				# Obstacle collisions
-				if pygame.sprite.spritecollide(laser, self.obstacles, True):
+				if self.hit_obstacles(laser):
 					laser.kill()
 				
 				# Aliens collisions
-				aliens_hit = pygame.sprite.spritecollide(laser, self.aliens_wave.group, True)
+				# Without the aliens killed by the previous lasers
+				aliens_hit = [alien for alien in candidates.get(laser, ()) if alien.alive()]
 				if aliens_hit:
 					for alien in aliens_hit:
+						alien.kill()
 						self.game.update_score(alien.value)
 					laser.kill()
-					# self.explosion_sound.play()
+					self.game.audio.play("explosion")
 				
 				# Extra collisions
 				extra_hit = pygame.sprite.spritecollide(laser, self.extra, True)
 				if extra_hit:
 					self.game.update_score(extra_hit[0].value)
 					laser.kill()
+					self.game.audio.play("explosion")
 		
-		# Possible collisions with aliens
-		if self.aliens_wave.group:
-			for alien in self.aliens_wave.group:
-				# Collision with obstacle
-				pygame.sprite.spritecollide(alien, self.obstacles, True)
-
-				# Collision with the player
-				if pygame.sprite.spritecollide(alien, self.player, False):
-					self.go_to_fail = True
+		# Possible collisions with aliens, only the ones low enough to reach
+		# the obstacles or the player are tested
+		for alien in self.aliens_wave.reaching(min(self.obstacles_top, self.player.sprite.rect.top)):
+			# Collision with obstacle
+			self.hit_obstacles(alien)
+
+			# Collision with the player
+			if pygame.sprite.spritecollide(alien, self.player, False):
+				self.go_to_fail = True
 		
 		# Alien lasers collisions
 		if self.aliens_wave.lasers:
 			for laser in self.aliens_wave.lasers:
 				# Obstacle collisions
-				if pygame.sprite.spritecollide(laser, self.obstacles, True):
+				if self.hit_obstacles(laser):
 					laser.kill()
 				
 				# Player collisions
 				if pygame.sprite.spritecollide(laser, self.player, False):
 					laser.kill()
+					self.game.audio.play("explosion")
 					self.player.sprite.lives -= 1
 					if not self.player.sprite.is_alive():
 						self.go_to_fail = True
 
 	def update(self, dt, events) -> None:
+		self.save_positions()
+		keys = self.game.get_keys()
+		if self.game.recorder is not None:
+			self.game.recorder.record(keys, self)
 		super().update(dt, events)
+		# Timers
+		self.scheduler.advance()
+		profiler = self.game.tick_profiler
 		self.obstacles.update()
+		profiler.start("aliens")
 		self.aliens_wave.update(dt)
 		# Check if there are still aliens on the screen
 		if not self.aliens_wave.still_remaining():
 			self.go_to_win = True
+		profiler.stop("aliens")
 		self.extra.update()
-		self.player.update(dt)
+		profiler.start("player")
+		self.player.update(dt, keys)
+		profiler.stop("player")
+		profiler.start("collisions")
 		self.check_collisions()
+		profiler.stop("collisions")
+		if self.game.spectators is not None:
+			self.game.spectators.publish(self)
 		self.transition_state()
 	
 	def handle_event(self, dt, event) -> None:
@@ -263,31 +391,83 @@ class GameWorld(State):
 		if event.type == pygame.KEYDOWN:
 			if event.key == pygame.K_ESCAPE:
 				self.go_to_pause = True
-		
-		if event.type == self.extra_timer_event:
-			# Spawn an extra
-			self.extra.add(Extra(choice(['right','left']), self.game.graphics_dir + "/extra.png"))
-			# Reset timer to a random time
-			pygame.time.set_timer(self.extra_timer_event , randint(4*1000, 8*1000))
-		
-		if event.type == self.alien_laser_event:
-			# Shoot a laser
-			self.aliens_wave.shoot_laser()
 			
 	def render(self, surface) -> None:
 		self.prev_state.render_background(surface)
-		# Sprites
-		self.obstacles.draw(surface)
-		self.aliens_wave.render(surface)
-		self.extra.draw(surface)
-		draw_text(surface, self.game.font, f'score: {self.game.score}', (255, 255, 255), 10, -10, options="topleft")
-		draw_lives(surface, self.live_surf, self.player.sprite.lives)
-		self.player.draw(surface)
-		self.player.sprite.lasers.draw(surface)
+		if self.background is None:
+			self.background = surface.copy()
+		self.render_sprites(surface)
+
+	def snapshot(self) -> WorldSnapshot:
+		"""Copy the positions of the last tick, the bunker images only when they are damaged."""
+		rows = []
+		for sprite in self.extra.sprites() + self.player.sprites():
+			x, y = sprite.rect.topleft
+			prev_x, prev_y = self.prev_positions.get(sprite, (x, y))
+			rows.append((sprite.image, x, y, prev_x, prev_y))
+		for laser in self.aliens_wave.lasers.sprites() + self.player.sprite.lasers.sprites():
+			rows.append((laser.image, laser.rect.x, laser.rect.y) + tuple(laser.prev_pos))
+		bunkers = []
+		for bunker in self.obstacles:
+			version, image = self.bunker_copies.get(bunker, (None, None))
+			if version != bunker.version:
+				image = bunker.image.copy()
+				self.bunker_copies[bunker] = (bunker.version, image)
+			bunkers.append((image, bunker.rect.topleft))
+		sprites = tuple(zip(*rows)) if rows else ((), (), (), (), ())
+		return WorldSnapshot(bunkers, self.aliens_wave.snapshot(), sprites, self.game.score, self.player.sprite.lives)
+
+	def render_snapshot(self, surface, snapshot: WorldSnapshot, alpha: float) -> None:
+		"""Draw a snapshot published by the simulation thread."""
+		self.prev_state.render_background(surface)
+		surface.blits(snapshot.bunkers, doreturn=False)
+		draw_lerp(surface, *snapshot.aliens, alpha)
+		draw_lerp(surface, *snapshot.sprites, alpha)
+		draw_text(surface, self.game.font, f'score: {snapshot.score}', (255, 255, 255), 10, -10, options="topleft")
+		draw_lives(surface, self.live_surf, snapshot.lives)
+
+	def render_dirty(self, surface) -> list:
+		"""Erase what was drawn at the last frame and draw the sprites again."""
+		canvas = surface.get_rect()
+		damaged = [bunker.rect for bunker in self.obstacles if bunker.version != self.bunker_versions.get(bunker)]
+		cleared = [rect.clip(canvas) for rect in self.drawn_rects + damaged]
+		surface.blits([(self.background, rect, rect) for rect in cleared], doreturn=False)
+		self.render_sprites(surface)
+		return cleared + self.drawn_rects
+
+	def save_positions(self) -> None:
+		"""Remember where the moving sprites are before the update."""
+		# The lasers remember their own previous position
+		moving = self.player.sprites() + self.extra.sprites()
+		self.prev_positions = {sprite: sprite.rect.topleft for sprite in moving}
+		self.aliens_wave.save_positions()
+
+	def render_sprites(self, surface) -> None:
+		# The sprites are drawn between their last two states
+		alpha = self.game.alpha
+		# Sprites, one Surface.blits call per layer
+		surface.blits([(bunker.image, bunker.rect) for bunker in self.obstacles], doreturn=False)
+		lasers_rects = self.aliens_wave.render(surface, alpha)
+		extra_rects = draw_interpolated(surface, self.extra, self.prev_positions, alpha)
+		score_rect = draw_text(surface, self.game.font, f'score: {self.game.score}', (255, 255, 255), 10, -10, options="topleft")
+		lives_rect = draw_lives(surface, self.live_surf, self.player.sprite.lives)
+		player_rects = draw_interpolated(surface, self.player, self.prev_positions, alpha)
+		lasers_rects += draw_interpolated(surface, self.player.sprite.lasers, None, alpha)
+
+		# Remember what has been drawn over the background
+		self.bunker_versions = {bunker: bunker.version for bunker in self.obstacles}
+		self.drawn_rects = [score_rect, lives_rect] + player_rects + extra_rects + lasers_rects
+		wave_rect = self.aliens_wave.bounding_rect()
+		if wave_rect is not None:
+			if self.aliens_wave.prev_rect is not None:
+				wave_rect.union_ip(self.aliens_wave.prev_rect)
+			self.drawn_rects.append(wave_rect)
 		
 	def transition_state(self) -> None:
 		# If go_to_fail -> FailState
 		new_state: State
+		if (self.go_to_fail or self.go_to_win) and self.game.recorder is not None:
+			self.game.recorder.stop(self)
 		if self.go_to_fail:
 			self.game.save_score()
 			# Kill the obstacles
@@ -309,8 +489,6 @@ class GameWorld(State):
 	
 	def reset(self) -> None:
 		self.game.reset_score()
-		self.laser_sound = pygame.mixer.Sound(self.game.audio_dir + "/laser.wav")
-		self.laser_sound.set_volume(0.1)
 		self.create_sprites()
 
 
@@ -319,6 +497,8 @@ class FailedMenu(State):
 	
 	Possess only Exit state.
 	"""
+	overlay = True
+
 	def __init__(self, game):
 		self.game = game
 	
@@ -337,15 +517,23 @@ class FailedMenu(State):
 				self.exit_state()
 	
 	def render(self, surface):
-		# Black
-		surface.fill(BACKGROUND_COLOR)
-		self.prev_state.render(surface)
+		backdrop = self.get_backdrop()
+		surface.blit(self.cached_layer(surface, (backdrop, self.game.score), self.render_layer), (0, 0))
+
+	def render_layer(self, surface):
+		surface.blit(self.get_backdrop(), (0, 0))
 		draw_text(surface, self.game.font, 'You died!', (255, 255, 255), GAME_W//2, GAME_H//2 - 50)
 		draw_text(surface, self.game.font, f'score: {self.game.score}', (255, 255, 255), GAME_W//2, GAME_H//2)
 
+	def render_dirty(self, surface):
+		# The world is frozen behind
+		return []
+
 
 class WinState(State):
 	"""This class handles when the player survives."""
+	overlay = True
+
 	def __init__(self, game) -> None:
 
 		self.game = game
@@ -365,14 +553,22 @@ class WinState(State):
 				self.exit_state()
 	
 	def render(self, surface):
-		# Black
-		surface.fill(BACKGROUND_COLOR)
-		self.prev_state.render(surface)
+		backdrop = self.get_backdrop()
+		surface.blit(self.cached_layer(surface, (backdrop, self.game.score), self.render_layer), (0, 0))
+
+	def render_layer(self, surface):
+		surface.blit(self.get_backdrop(), (0, 0))
 		draw_text(surface, self.game.font, 'You won!', (255, 255, 255), GAME_W//2, GAME_H//2 - 50)
 		draw_text(surface, self.game.font, f'score: {self.game.score}', (255, 255, 255), GAME_W//2, GAME_H//2)
 
+	def render_dirty(self, surface):
+		# The world is frozen behind
+		return []
+
 
 class PauseMenu(State):
+	overlay = True
+
 	def __init__(self, game):
 		super(PauseMenu, self).__init__(game)
 		self.trigger_state = False
@@ -398,12 +594,24 @@ class PauseMenu(State):
 		elif self.menu.get_option() == "Exit" and self.trigger_state:
 			self.game.save_score()
 			self.trigger_state = False
+			# The recorded game ends here
+			if self.game.recorder is not None:
+				self.game.recorder.stop(self.prev_state)
 			while len(self.game.state_stack) > 1:
 				self.game.state_stack.pop()
 
 	def render(self, surface):
-		surface.fill(BACKGROUND_COLOR)
-		self.prev_state.render(surface)
-		self.menu.render(surface)
+		backdrop = self.get_backdrop()
+		surface.blit(self.cached_layer(surface, backdrop, self.render_layer), (0, 0))
+		self.menu.render_cursor(surface)
+
+	def render_layer(self, surface):
+		surface.blit(self.get_backdrop(), (0, 0))
+		self.menu.render_options(surface)
+
+	def render_dirty(self, surface):
+		# The frozen world behind does not change, only the cursor moves
+		self.menu.render_cursor(surface, self.cached_layer(surface, self.get_backdrop(), self.render_layer))
+		return self.menu.dirty_rects
 
 		
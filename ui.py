@@ -1,11 +1,54 @@
 import pygame
 
+from collections import OrderedDict
 from pygame.math import Vector2
 from settings import *
 
-def draw_text(surface, font, text, color, x, y, options: str = 'center') -> None:
+
+class TextCache():
+    """Bounded cache of rendered text surfaces.
+    
+    Surfaces are keyed by (font, text, color, antialias) and the least recently
+    used one is evicted when the cache is full."""
+    def __init__(self, max_size: int = 256) -> None:
+        self.max_size: int = max_size
+        self.surfaces: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def render(self, font, text: str, antialias: bool, color) -> pygame.Surface:
+        if isinstance(color, list):
+            color = tuple(color)
+        key = (font, text, color, antialias)
+        text_surface = self.surfaces.get(key)
+        if text_surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return text_surface
+        self.misses += 1
+        text_surface = font.render(text, antialias, color)
+        self.surfaces[key] = text_surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return text_surface
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.surfaces),
+                "hit_rate": self.hits / total if total else 0.}
+
+    def clear(self) -> None:
+        self.surfaces.clear()
+        self.hits, self.misses = 0, 0
+
+
+# Shared by every draw_text call
+text_cache = TextCache(TEXT_CACHE_SIZE)
+
+
+def draw_text(surface, font, text, color, x, y, options: str = 'center') -> pygame.Rect:
     assert options in ["center", "topleft"]
-    text_surface = font.render(text, True, color)
+    text_surface = text_cache.render(font, text, True, color)
     text_rect = text_surface.get_rect()
     if options == "topleft":
         text_rect.topleft = (x, y)
@@ -13,13 +56,40 @@ def draw_text(surface, font, text, color, x, y, options: str = 'center') -> None
         text_rect.center = (x, y)
     
     surface.blit(text_surface, text_rect)
+    return text_rect
+
+
+def draw_interpolated(surface, sprites, previous: dict, alpha: float) -> list:
+    """Draw the sprites between their previous and current positions.
+    
+    'previous' maps a sprite to its topleft before the last update, alpha in [0, 1]
+    is the progress toward the current position. With previous=None, the sprites
+    carry their own 'prev_pos'. The sprites are drawn with a single Surface.blits
+    call. Returns the drawn rects."""
+    sequence = []
+    for sprite in sprites:
+        x, y = sprite.rect.topleft
+        if previous is None or sprite in previous:
+            prev_x, prev_y = sprite.prev_pos if previous is None else previous[sprite]
+            x, y = round(prev_x + (x - prev_x) * alpha), round(prev_y + (y - prev_y) * alpha)
+        sequence.append((sprite.image, (x, y)))
+    return surface.blits(sequence)
 
 
-def draw_lives(surface, img, lives: int) -> None:
+def draw_lerp(surface, images, x, y, prev_x, prev_y, alpha: float) -> list:
+    """Draw images between their previous and current positions, given as columns."""
+    return surface.blits([(image, (round(px + (cx - px) * alpha), round(py + (cy - py) * alpha)))
+                          for image, cx, cy, px, py in zip(images, x, y, prev_x, prev_y)])
+
+
+def draw_lives(surface, img, lives: int) -> pygame.Rect:
+    """Draw the remaining lives and return the area they cover."""
     x_offset:int = GAME_W - (img.get_size()[0] * 2 + 20)
-    for life in range(lives-1):
-        x = x_offset + (life * (img.get_size()[0] + 10))
-        surface.blit(img, (x, 8))
+    area = pygame.Rect(x_offset, 8, 0, 0)
+    step = img.get_size()[0] + 10
+    for rect in surface.blits([(img, (x_offset + life * step, 8)) for life in range(lives-1)]):
+        area.union_ip(rect)
+    return area
 
 class Cursor():
     """A Cursor UI.
@@ -79,6 +149,9 @@ class TextMenu():
         self.font = font
         self.cursor = Cursor(Vector2((x_range[1]-x_range[0])//4, 0.), len(self.menu_options), y_range, color=self.color)
         self.y_pos: dict = self.cursor.get_index_pos()
+        # Cursor areas changed by the last render
+        self.rendered_rect = None
+        self.dirty_rects: list = []
 
     def update(self, event) -> None:
 
@@ -90,7 +163,21 @@ class TextMenu():
     
     def render(self, surface) -> None:
         self.render_options(surface)
+        self.render_cursor(surface)
+
+    def render_cursor(self, surface, background=None) -> None:
+        """Draw the cursor, after restoring its previous area from background if given."""
+        if background is not None and self.rendered_rect is not None:
+            surface.blit(background, self.rendered_rect, self.rendered_rect)
         self.cursor.render(surface)
+        # Only the cursor moves
+        previous, self.rendered_rect = self.rendered_rect, self.cursor.rect.copy()
+        if previous is None:
+            self.dirty_rects = [self.rendered_rect]
+        elif previous != self.rendered_rect:
+            self.dirty_rects = [previous, self.rendered_rect]
+        else:
+            self.dirty_rects = []
 
     def render_options(self, surface) -> None:
         for index, val in zip(range(len(self.menu_options)), self.menu_options.values()):
@@ -0,0 +1,179 @@
+import numpy as np
+import pygame
+
+from settings import *
+from sprites import Alien, AliensWave
+from ui import draw_interpolated
+
+
+class WaveAlien(Alien):
+    """An alien whose state lives in the arrays of a VectorAliensWave.
+
+    The sprite only keeps its index: the rect is built from the arrays on access
+    so nothing has to be synced when the whole wave moves.
+    """
+    def __init__(self, wave, index: int, image: pygame.Surface, value: int) -> None:
+        pygame.sprite.Sprite.__init__(self)
+        self.wave = wave
+        self.index: int = index
+        self.image = image
+        self.value: int = value
+
+    @property
+    def rect(self) -> pygame.Rect:
+        i = self.index
+        return pygame.Rect(int(self.wave.x[i]), int(self.wave.y[i]), int(self.wave.w[i]), int(self.wave.h[i]))
+
+    def move_down(self, y_offset: int) -> None:
+        self.wave.y[self.index] += y_offset
+
+    def update(self, dir: int) -> None:
+        self.wave.x[self.index] += dir * ALIEN_SPEED
+
+    def kill(self) -> None:
+        self.wave.alive[self.index] = False
+        super().kill()
+
+
+class VectorAliensWave(AliensWave):
+    """A wave of aliens stored as a structure of arrays.
+
+    Positions, sizes, alive flags and values are contiguous NumPy arrays, so the
+    edge detection, the move down and the remaining check are single vectorized
+    operations whatever the size of the wave. The sprites in 'group' read their
+    rect from these arrays and are only used for collisions.
+    """
+    COLORS: tuple = ("yellow", "green", "red")
+    VALUES: tuple = (300, 200, 100)
+
+    def __init__(self, assets, audio, rng=None) -> None:
+        super().__init__(assets, audio, rng)
+        # One image per color, shared by all the aliens
+        self.images: list = [self.assets.image(f"{color}.png") for color in self.COLORS]
+        self.reset_arrays()
+
+    def reset_arrays(self) -> None:
+        self.x: np.ndarray = np.empty(0, dtype=np.int32)
+        self.y: np.ndarray = np.empty(0, dtype=np.int32)
+        self.w: np.ndarray = np.empty(0, dtype=np.int32)
+        self.h: np.ndarray = np.empty(0, dtype=np.int32)
+        self.kind: np.ndarray = np.empty(0, dtype=np.int8)
+        self.values: np.ndarray = np.empty(0, dtype=np.int32)
+        self.alive: np.ndarray = np.empty(0, dtype=bool)
+        self.prev_x = None
+        self.prev_y = None
+        self.prev_rect = None
+
+    def create_wave(self, rows: int, cols: int, x_dist: int = 60, y_dist: int = 48, x_start: int = 70, y_start: int = 100) -> None:
+        row_index, col_index = np.divmod(np.arange(rows * cols, dtype=np.int32), cols)
+        # Chose the color: yellow for the first row, green for the two next ones, red otherwise
+        kind = np.where(row_index == 0, 0, np.where(row_index <= 2, 1, 2)).astype(np.int8)
+        sizes = np.array([image.get_size() for image in self.images], dtype=np.int32)
+        first = len(self.x)
+
+        self.x = np.concatenate((self.x, col_index * x_dist + x_start))
+        self.y = np.concatenate((self.y, row_index * y_dist + y_start))
+        self.w = np.concatenate((self.w, sizes[kind, 0]))
+        self.h = np.concatenate((self.h, sizes[kind, 1]))
+        self.kind = np.concatenate((self.kind, kind))
+        self.values = np.concatenate((self.values, np.take(self.VALUES, kind)))
+        self.alive = np.concatenate((self.alive, np.ones(rows * cols, dtype=bool)))
+
+        # Sprites used for collisions
+        kinds = kind.tolist()
+        aliens = [WaveAlien(self, first + i, self.images[k], self.VALUES[k]) for i, k in enumerate(kinds)]
+        self.group.add(aliens)
+        self.aliens += aliens
+
+    def check_position(self) -> None:
+        if not self.alive.any():
+            return
+        x = self.x[self.alive]
+        if (x + self.w[self.alive]).max() >= GAME_W:
+            self.wave_dir = -1
+            self.move_down(ALIEN_MOVE_DOWN_SPEED)
+        elif x.min() <= 0:
+            self.wave_dir = 1
+            self.move_down(ALIEN_MOVE_DOWN_SPEED)
+
+    def move_down(self, y_offset) -> None:
+        """Move down all the aliens in the wave."""
+        self.y += y_offset
+
+    def still_remaining(self) -> bool:
+        return bool((self.y[self.alive] <= GAME_H).any())
+
+    def bounding_rect(self):
+        if not self.alive.any():
+            return None
+        x, y = self.x[self.alive], self.y[self.alive]
+        left, top = int(x.min()), int(y.min())
+        right, bottom = int((x + self.w[self.alive]).max()), int((y + self.h[self.alive]).max())
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def shoot_laser(self) -> None:
+        # Shoot a laser from a random alive alien
+        alive = np.flatnonzero(self.alive)
+        if len(alive):
+            i = self.rng.choice(alive)
+            center = (int(self.x[i] + self.w[i] // 2), int(self.y[i] + self.h[i] // 2))
+            if self.laser_pool.fire(center, ALIEN_LASER_SPEED) is not None:
+                self.audio.play("alien_laser")
+
+    def clear_wave(self) -> None:
+        super().clear_wave()
+        self.reset_arrays()
+
+    def update(self, dt) -> None:
+        self.check_position()
+        self.x += self.wave_dir * ALIEN_SPEED
+        self.lasers.update(dt)
+
+    def save_positions(self) -> None:
+        self.prev_x = self.x.copy()
+        self.prev_y = self.y.copy()
+        self.prev_rect = self.bounding_rect()
+
+    def collide(self, rect: pygame.Rect) -> list:
+        return self.collide_many([rect])[0]
+
+    def collide_many(self, rects: list) -> list:
+        # One vectorized test of every rect against every alive alien, no hash to keep in sync
+        if not rects:
+            return []
+        alive = np.flatnonzero(self.alive)
+        x, y = self.x[alive], self.y[alive]
+        left, top, right, bottom = np.array([(r.left, r.top, r.right, r.bottom) for r in rects], dtype=np.int32).T[:, :, None]
+        hit = (x < right) & (x + self.w[alive] > left) & (y < bottom) & (y + self.h[alive] > top)
+        rows, cols = np.nonzero(hit)
+        hits: list = [[] for _ in rects]
+        aliens = self.aliens
+        for row, i in zip(rows.tolist(), alive[cols].tolist()):
+            hits[row].append(aliens[i])
+        return hits
+
+    def reaching(self, top: int) -> list:
+        return list(map(self.aliens.__getitem__, np.flatnonzero(self.alive & (self.y + self.h >= top)).tolist()))
+
+    def grid(self) -> tuple:
+        return self.alive, self.x, self.y, self.values
+
+    def snapshot(self) -> tuple:
+        alive = np.flatnonzero(self.alive)
+        x, y = self.x[alive], self.y[alive]
+        prev_x, prev_y = x, y
+        if self.prev_x is not None and len(self.prev_x) == len(self.x):
+            prev_x, prev_y = self.prev_x[alive], self.prev_y[alive]
+        images = list(map(self.images.__getitem__, self.kind[alive].tolist()))
+        return images, x.tolist(), y.tolist(), prev_x.tolist(), prev_y.tolist()
+
+    def render(self, surface, alpha: float = 1.) -> list:
+        alive = np.flatnonzero(self.alive)
+        x, y = self.x[alive], self.y[alive]
+        if alpha < 1. and self.prev_x is not None and len(self.prev_x) == len(self.x):
+            prev_x, prev_y = self.prev_x[alive], self.prev_y[alive]
+            x = np.rint(prev_x + (x - prev_x) * alpha).astype(np.int32)
+            y = np.rint(prev_y + (y - prev_y) * alpha).astype(np.int32)
+        images = map(self.images.__getitem__, self.kind[alive].tolist())
+        surface.blits(zip(images, zip(x.tolist(), y.tolist())), doreturn=False)
+        return draw_interpolated(surface, self.lasers, None, alpha)